@@ -0,0 +1,97 @@
+#***********************************
+# Program Name : WFMCache.py
+# Description  : Orisoft reference data (schedule types, group schedules) kept in a pickle file between runs,
+#                reused while younger than the TTL and unchanged in the database.
+#************************************
+
+import os
+import threading
+import cPickle
+import time
+
+
+def replaceFile(filename, data):
+    """
+    Writes data to a file of this process then renames it to filename, so other processes never read half a file
+    """
+    temp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        output = open(temp, 'wb')
+        try:
+            output.write(data)
+        finally:
+            output.close()
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp, filename)
+    except (IOError, OSError):
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+class ReferenceCache(object):
+    """
+    Rows of the reference tables by key, each saved with the time it was read and the signature of the
+    table at that time (row count and max id). An entry is used only while younger than ttl seconds and
+    while the table still has the same signature, the TTL also covers rows changed in place.
+    """
+    def __init__(self, filename, ttl=86400):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = None                     # key -> (time read, signature, rows), loaded on first use
+        self.lock = threading.Lock()            # the reference queries run on parallel threads
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        # a missing or unreadable file is an empty cache, it is rebuilt by the next puts
+        try:
+            cache = open(self.filename, 'rb')
+            try:
+                self.entries = cPickle.load(cache)
+            finally:
+                cache.close()
+        except Exception:
+            self.entries = {}
+
+    def get(self, key, signature):
+        """
+        Returns the cached rows of key if they are still valid for signature, else None
+        """
+        self.lock.acquire()
+        try:
+            if self.entries is None:
+                self.load()
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl and entry[1] == signature:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+        finally:
+            self.lock.release()
+
+    def put(self, key, signature, rows):
+        """
+        Saves the rows of key read with signature, the expired entries are dropped
+        """
+        self.lock.acquire()
+        try:
+            if self.entries is None:
+                self.load()
+            now = time.time()
+            for (oldKey, entry) in self.entries.items():
+                if now - entry[0] >= self.ttl:
+                    del self.entries[oldKey]
+            self.entries[key] = (now, signature, rows)
+            self.save()
+        finally:
+            self.lock.release()
+
+    def save(self):
+        # the cache is only an optimization, a file that cannot be written is left as it is
+        try:
+            replaceFile(self.filename, cPickle.dumps(self.entries, cPickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,1473 @@
+#***********************************
+# Program Name : WFMEngine.py
+# Description  : extract, transform and load of the employees schedules from WFM into Orisoft.
+#                Used by the WFM_Interface window and by the WFM_Batch command line, does not import PySide.
+#************************************
+
+import os
+import sys
+import cProfile
+import ConfigParser
+import StringIO
+from datetime import datetime, date, timedelta
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from WFMSchedule import *
+from WFMPool import ConnectionPool
+from WFMCache import ReferenceCache, replaceFile
+from WFMMetrics import StageMetrics, TimedCursor, TimedConnection, peakMemory, writeRunLog
+
+
+pyodbc = None                   # imported by loadOdbc, the interface window is shown before the ODBC driver manager is loaded
+
+
+def loadOdbc():
+    """
+    Returns the pyodbc module, imported on first use
+    """
+    global pyodbc
+    if pyodbc is None:
+        import pyodbc
+    return pyodbc
+
+
+def fastExecutemany(cur):
+    # fast_executemany sends the whole batch as one parameter array (pyodbc 4.0.19 and later)
+    if hasattr(cur, 'fast_executemany'):
+        cur.fast_executemany = True
+
+
+class ConfigError(Exception):
+    pass
+
+
+class ConnectError(Exception):
+    pass
+
+
+class ProcessCancelled(Exception):
+    pass
+
+
+class WFMEngine(object):
+
+    # minimum number of seconds between two progress updates sent to the status callback
+    statusInterval = 0.25
+
+    # settings the shard workers take from the coordinator instead of the configuration file,
+    # so the command line overrides and the high-water mark of the run are the same in every shard
+    shardOptions = ('batchSize', 'writeMode', 'incremental', 'parallelExtract', 'semiJoin', 'commitEvery', 'resume',
+                    'shiftMap', 'shiftFallback', 'lastModify', 'syncedRange')
+
+    def __init__(self, iniFile='WFM_Interface.ini', status=None):
+        self.iniFile = iniFile
+        self.checkpointFile = os.path.splitext(iniFile)[0] + '.checkpoint'    # last committed chunk of a failed run
+        self.status = status                    # function called with the progress text
+        self.connOriTMS = None
+        self.connWFM = None
+        self.connCtrl = None                    # autocommit connection used to reserve record IDs
+        self.pools = {}                         # ConnectionPool by database, empty for a new connection every time
+
+        self.employees = {}                     # active employees by employee no
+        self.daysRange = []                     # list of days from dateFrom to dateTo
+        self.periods = []                       # (year, month) of every month in the date range
+        self.dayPeriods = []                    # index into periods of every day offset
+        self.groupSchedule = {}                 # workgroup -> list of REFER_ID by period index
+        self.validSchedType = set()             # a set of valid schedule types in Orisoft
+        self.shiftMap = {}                      # [ShiftMap] shift times -> schedule type, see ShiftTranslator
+        self.shiftFallback = False              # guess the schedule type of the shifts without one, see ShiftTranslator
+        self.cache = None                       # ReferenceCache of schedule_type and group_schedule_hd
+        self.schedules = None                   # ScheduleMatrix of the WFM schedules by payroll
+        self.unmatchedPayrolls = []             # WFM payrolls without an active Orisoft badge
+        self.unmatchedBadges = []               # active Orisoft badges without a WFM roster
+        self.matchSummary = ''
+
+        self.lastModify = None                  # latest roster_staff modification synced by a committed run
+        self.syncedRange = None                 # (dateFrom, dateTo) of the run that synced lastModify
+        self.pendingLastModify = None           # latest modification fetched by the running process, not committed yet
+        self.changedDays = None                 # (first, last) day offsets of the run that only have the changed rows
+        self.unstampedRows = 0                  # WFM rows fetched without modification time
+
+        self.shard = None                       # ('workgroup', codes) or ('payroll', first, end) processed by this engine
+        self.savedCount = 0                     # schedule rows written by the last run
+        self.resume = True                      # continue after the checkpoint of a failed run of the same dates
+        self.resumeAfter = None                 # payroll of the checkpoint the current run continues after
+        self.savedExceptions = 0                # exception records already written to user_wfm_exception
+        self.exceptions = []                    # ScheduleException records of the last run
+        self.exceptionDays = set()              # (payroll, day) of the day exceptions, diff mode keeps their schedules
+        self.timings = []                       # (stage, seconds) of the last run
+        self.metrics = []                       # StageMetrics of the last run
+        self.shardMetrics = []                  # stage metric records of the shards of the last sharded run
+        self.currentStage = None                # StageMetrics of the running stage, its statements are timed
+        self.runLog = None                      # JSON-lines file the metrics of every run are appended to
+        self.profile = False                    # profile the runs with cProfile
+        self.saveRate = ''
+        self.cancelRequested = False
+        self.lastStatusTime = 0
+
+    def readIni(self):
+        """
+        Reads the DSNs, last process history and options from the configuration file
+        """
+        # test if config file exists
+        if not os.path.exists(self.iniFile):
+            raise ConfigError("The configuration file '%s' in '%s' not found!" % (self.iniFile, os.getcwd()))
+
+        try:
+            config = ConfigParser.ConfigParser()
+            config.read(self.iniFile)
+
+            # read Orisoft TMS settings
+            self.orisoftDsn = config.get('OrisoftTMSDSN', 'dsn')
+            self.orisoftUser = config.get('OrisoftTMSDSN', 'uid')
+            self.orisoftPwd = config.get('OrisoftTMSDSN', 'pwd')
+
+            self.wfmDsn = config.get('WFM_DSN', 'dsn')
+            self.wfmUser = config.get('WFM_DSN', 'uid')
+            self.wfmPwd = config.get('WFM_DSN', 'pwd')
+            # read last date processed
+            self.dateFromPrev = config.get('History', 'datefrom')
+            self.dateToPrev = config.get('History', 'dateto')
+
+            # latest roster_staff modification synced by the previous runs, and the dates it is valid for.
+            # Only the days of that range can be read incrementally, a mark without range is not used
+            self.lastModify = None
+            self.syncedRange = None
+            if config.has_option('History', 'lastmodify'):
+                self.lastModify = datetime.strptime(config.get('History', 'lastmodify'), '%Y-%m-%d %H:%M:%S.%f')
+                if config.has_option('History', 'lastmodifyfrom') and config.has_option('History', 'lastmodifyto'):
+                    self.syncedRange = (datetime.strptime(config.get('History', 'lastmodifyfrom'), '%Y-%m-%d').date(),
+                                        datetime.strptime(config.get('History', 'lastmodifyto'), '%Y-%m-%d').date())
+
+            # number of schedule rows sent to Orisoft per batch
+            self.batchSize = 1000
+            if config.has_option('Options', 'batchsize'):
+                self.batchSize = config.getint('Options', 'batchsize')
+
+            # insert : batched INSERTs, duplicates are retried row by row
+            # upsert : stage the schedules then apply them with one DELETE and one INSERT per run
+            # diff   : read the existing schedules of the range and write only the inserts, updates and deletes needed
+            self.writeMode = 'insert'
+            if config.has_option('Options', 'writemode'):
+                self.writeMode = config.get('Options', 'writemode').lower()
+
+            # fetch only the WFM roster rows modified since [History] lastmodify on the days it was synced for
+            self.incremental = False
+            if config.has_option('Options', 'incremental'):
+                self.incremental = config.getboolean('Options', 'incremental')
+
+            # run the Orisoft and WFM extraction queries at the same time, each on its own connection
+            self.parallelExtract = True
+            if config.has_option('Options', 'parallelextract'):
+                self.parallelExtract = config.getboolean('Options', 'parallelextract')
+
+            # load only the active employees whose payroll has a WFM roster in the date range
+            self.semiJoin = True
+            if config.has_option('Options', 'semijoin'):
+                self.semiJoin = config.getboolean('Options', 'semijoin')
+
+            # commit the schedules every commitevery employees and record the last one in the checkpoint file,
+            # 0 saves the whole run in one transaction
+            self.commitEvery = 0
+            if config.has_option('Options', 'commitevery'):
+                self.commitEvery = config.getint('Options', 'commitevery')
+
+            # number of worker processes, each runs the process for its own part of the employees
+            self.shards = 1
+            if config.has_option('Options', 'shards'):
+                self.shards = config.getint('Options', 'shards')
+
+            # the stage metrics of every run are appended to runlog, next to the configuration file, empty for none
+            self.runLog = os.path.join(os.path.dirname(self.iniFile), 'WFM_RunLog.jsonl')
+            if config.has_option('Options', 'runlog'):
+                runLog = config.get('Options', 'runlog').strip()
+                self.runLog = runLog and os.path.join(os.path.dirname(self.iniFile), runLog) or None
+
+            # profile the runs into WFM_Profile.prof next to the configuration file, only the main thread
+            # is profiled so parallelextract should be off to include the extraction queries
+            self.profile = False
+            if config.has_option('Options', 'profile'):
+                self.profile = config.getboolean('Options', 'profile')
+
+            # schedule types and group schedules are kept in cachefile, next to the configuration file, for up
+            # to cachettl seconds while the tables are unchanged, an empty cachefile reads them on every run
+            cacheFile = 'WFM_Cache.pkl'
+            if config.has_option('Options', 'cachefile'):
+                cacheFile = config.get('Options', 'cachefile').strip()
+            cacheTtl = 86400
+            if config.has_option('Options', 'cachettl'):
+                cacheTtl = config.getint('Options', 'cachettl')
+            self.cache = None
+            if cacheFile:
+                self.cache = ReferenceCache(os.path.join(os.path.dirname(self.iniFile), cacheFile), cacheTtl)
+
+            # workgroup : the employees are split by work_group_code
+            # payroll   : the employees are split into payroll ranges
+            self.shardBy = 'workgroup'
+            if config.has_option('Options', 'shardby'):
+                self.shardBy = config.get('Options', 'shardby').lower()
+            if self.shardBy not in ('workgroup', 'payroll'):
+                raise ConfigError("Invalid shardby '%s', expected workgroup or payroll" % self.shardBy)
+
+            # schedule types of the WFM shifts whose hour code is not the Orisoft schedule type
+            self.shiftMap = {}
+            if config.has_section('ShiftMap'):
+                for (times, schedType) in config.items('ShiftMap'):
+                    if not ShiftTranslator.mapKey.match(times):
+                        raise ConfigError("Invalid [ShiftMap] entry '%s', expected hhmm-hhmm or hhmm-hhmm/hhmm-hhmm" % times)
+                    self.shiftMap[times] = schedType.strip()
+
+            # shifts without [ShiftMap] entry or valid hour code try the guessed hour codes of the whole span
+            # and rounded to the hour, every row saved with a guessed schedule type is reported
+            self.shiftFallback = False
+            if config.has_option('Options', 'shiftfallback'):
+                self.shiftFallback = config.getboolean('Options', 'shiftfallback')
+
+        except (ConfigParser.Error, ValueError), e:
+            raise ConfigError(str(e))
+
+    def saveIni(self, history=True):
+        """
+        Saves the date range and the WFM high-water mark of the last run to the configuration file,
+        only the high-water mark if history is False
+        """
+        config = ConfigParser.ConfigParser()
+        config.read(self.iniFile)
+
+        # save dateFrom/dateTo
+        if history:
+            config.set('History', 'datefrom', self.dateFrom)
+            config.set('History', 'dateto', self.dateTo)
+
+        # save the WFM high-water mark used by incremental runs and the dates it was synced for
+        if self.lastModify and self.syncedRange:
+            config.set('History', 'lastmodify', self.lastModify.strftime('%Y-%m-%d %H:%M:%S.%f'))
+            config.set('History', 'lastmodifyfrom', self.syncedRange[0].isoformat())
+            config.set('History', 'lastmodifyto', self.syncedRange[1].isoformat())
+
+        ini = open(self.iniFile, 'w')
+        config.write(ini)
+        ini.close()
+
+    def readCheckpoint(self):
+        """
+        Returns the last committed payroll of a failed run of the same dates and options, or None.
+        Shards never checkpoint, they would all rewrite the same checkpoint file.
+        """
+        if not self.resume or not self.commitEvery or self.shard is not None:
+            return None
+
+        config = ConfigParser.ConfigParser()
+        config.read(self.checkpointFile)
+        if not config.has_section('Checkpoint'):
+            return None
+
+        checkpoint = dict(config.items('Checkpoint'))
+        if (checkpoint.get('datefrom'), checkpoint.get('dateto'), checkpoint.get('writemode'), checkpoint.get('overwrite')) != \
+                (str(self.dateFrom), str(self.dateTo), self.writeMode, str(int(self.overWrite))):
+            return None
+        return checkpoint.get('payroll')
+
+    def saveCheckpoint(self, payroll):
+        """
+        Records payroll as the last employee whose schedules are committed. The checkpoint has its own
+        file, written after every chunk, so the configuration file with the credentials is left alone.
+        """
+        if not self.commitEvery or self.shard is not None:
+            return
+
+        config = ConfigParser.ConfigParser()
+        config.add_section('Checkpoint')
+
+        config.set('Checkpoint', 'datefrom', self.dateFrom)
+        config.set('Checkpoint', 'dateto', self.dateTo)
+        config.set('Checkpoint', 'writemode', self.writeMode)
+        config.set('Checkpoint', 'overwrite', int(self.overWrite))
+        config.set('Checkpoint', 'payroll', payroll)
+        config.set('Checkpoint', 'saved', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+        checkpoint = StringIO.StringIO()
+        config.write(checkpoint)
+        replaceFile(self.checkpointFile, checkpoint.getvalue())
+
+    def clearCheckpoint(self):
+        """
+        Removes the checkpoint file once the run is complete
+        """
+        if self.shard is not None:
+            return
+
+        if os.path.exists(self.checkpointFile):
+            os.remove(self.checkpointFile)
+
+    def openConnection(self, database, autocommit=False):
+        """
+        Returns a new connection to database, 'orisoft' or 'wfm'
+        """
+        if database == 'orisoft':
+            return loadOdbc().connect('DSN=%s; UID=%s; PWD=%s' % (self.orisoftDsn, self.orisoftUser, self.orisoftPwd), autocommit=autocommit)
+        else:
+            return loadOdbc().connect('DSN=%s; UID=%s; PWD=%s' % (self.wfmDsn, self.wfmUser, self.wfmPwd), autocommit=autocommit)
+
+    def usePools(self, size):
+        """
+        Keeps up to size idle connections to each database between runs instead of opening new ones
+        """
+        for database in ('orisoft', 'wfm', 'ctrl'):
+            self.pools[database] = ConnectionPool(lambda database=database: self.openPooled(database), size, loadOdbc().Error)
+
+    def openPooled(self, database):
+        # ctrl is the autocommit Orisoft connection of reserveIds
+        if database == 'ctrl':
+            return self.openConnection('orisoft', autocommit=True)
+        return self.openConnection(database)
+
+    def checkout(self, database):
+        """
+        Returns a connection to database, 'orisoft', 'wfm' or 'ctrl', from its pool if there is one
+        """
+        if database in self.pools:
+            return self.pools[database].acquire()
+        return self.openPooled(database)
+
+    def checkin(self, database, conn, broken=False):
+        """
+        Gives back a connection of checkout, it is closed if there is no pool
+        """
+        if database in self.pools:
+            self.pools[database].release(conn, broken)
+        else:
+            conn.close()
+
+    def connect(self):
+        try:
+            # connection for Orisoft TMS Database
+            self.connOriTMS = self.checkout('orisoft')
+            self.connWFM = self.checkout('wfm')
+        except loadOdbc().Error, e:
+            raise ConnectError(str(e))
+
+    def close(self, broken=False):
+        """
+        Closes the connections or gives them back to their pools, broken connections are not reused
+        """
+        for (database, conn) in (('orisoft', self.connOriTMS), ('wfm', self.connWFM), ('ctrl', self.connCtrl)):
+            if conn is not None:
+                self.checkin(database, conn, broken)
+
+        self.connOriTMS = None
+        self.connWFM = None
+        self.connCtrl = None
+
+    def closePools(self):
+        for pool in self.pools.values():
+            pool.closeAll()
+
+    def reserveIds(self, count):
+        """
+        Reserves count record IDs of employee_schedule from ofcctrlid and returns the first one.
+
+        The counter is read and advanced by one UPDATE committed on its own connection, so the row
+        lock is held only for that statement and parallel runs or other Orisoft writers never get
+        the same IDs. IDs reserved by a run that is rolled back are not reused.
+        """
+        if self.connCtrl is None:
+            self.connCtrl = self.checkout('ctrl')
+
+        cur = self.timedCursor(self.connCtrl)
+        cur.execute("Update ofcctrlid set ctrlctr = convert(int, ctrlctr) + ? " \
+            "output deleted.ctrlctr where ctrlcol = 'employee_schedule'", (count,))
+        firstID = int(cur.fetchone()[0])
+        cur.close()
+        return firstID
+
+    def integrityError(self):
+        # the duplicate key error of the database driver
+        return loadOdbc().IntegrityError
+
+    def releaseIds(self, endID, firstUnused):
+        """
+        Gives back the IDs firstUnused to endID - 1 of the last block reserved by reserveIds.
+        The counter only moves back if nobody reserved IDs after that block, else the gap is kept.
+        """
+        cur = self.timedCursor(self.connCtrl)
+        cur.execute("Update ofcctrlid set ctrlctr = ? where ctrlcol = 'employee_schedule' and convert(int, ctrlctr) = ?",
+            (firstUnused, endID))
+        cur.close()
+
+    def process(self, dateFrom, dateTo, overWrite=True):
+        """
+        Runs the process for the dates dateFrom to dateTo, in self.shards worker processes when more than one
+        """
+        if self.shards > 1:
+            return self.runShards(dateFrom, dateTo, overWrite)
+        return self.run(dateFrom, dateTo, overWrite)
+
+    def run(self, dateFrom, dateTo, overWrite=True, truncate=True):
+        """
+        Runs all the process stages for the dates dateFrom to dateTo.
+        Returns the list of (stage, seconds) timings, the work is rolled back if a stage fails.
+        The exception table is left as is when truncate is False, a sharded run truncates it once.
+        """
+        self.dateFrom = dateFrom
+        self.dateTo = dateTo
+        self.overWrite = overWrite
+
+        self.employees = {}
+        self.groupSchedule = {}
+        self.validSchedType = set()
+        self.schedules = None
+        self.exceptions = []
+        self.exceptionDays = set()
+        self.timings = []
+        self.metrics = []
+        self.shardMetrics = []
+        self.savedCount = 0
+        self.savedExceptions = 0
+        self.resumeAfter = self.readCheckpoint()
+
+        stages = [('getDaysRange', self.getDaysRange),
+                  ('extract', self.extract),
+                  ('saveSchedules', self.saveSchedules)]
+        runStart = time.time()
+        profiler = self.startProfile()
+        (status, error) = ('ok', None)
+        try:
+            if self.resumeAfter is not None:
+                # the exceptions of the committed employees are already in the table
+                self.loadExceptions()
+            elif truncate:
+                cur = self.connOriTMS.cursor()
+                # truncate the WFM Exception table
+                cur.execute('Truncate table dbo.user_wfm_exception')
+
+            for (name, stage) in stages:
+                self.currentStage = StageMetrics(name)
+                stage()
+                self.stopStage()
+            # saveSchedules has committed, a failed run reads the same changes again
+            self.commitWatermark(self.pendingLastModify)
+        except:
+            (status, error) = self.runFailure()
+            self.connOriTMS.rollback()
+            raise
+        finally:
+            self.currentStage = None
+            self.logRun(runStart, status, error, profiler)
+
+        return self.timings
+
+    def commitWatermark(self, lastModify):
+        """
+        Makes lastModify, fetched by a run that is committed, the high-water mark of its dates
+        """
+        if lastModify is not None:
+            self.lastModify = lastModify
+            self.syncedRange = (self.dateFrom, self.dateTo)
+
+    def stopStage(self):
+        """
+        Stops the metrics of the running stage and adds them to the metrics and timings of the run
+        """
+        stage = self.currentStage
+        if stage.name == 'getDaysRange':
+            stage.stop(len(self.daysRange))
+        elif stage.name in ('saveSchedules', 'runShards'):
+            stage.stop(self.savedCount)
+        else:
+            stage.stop()
+        self.metrics.append(stage)
+        self.timings.append((stage.name, stage.seconds))
+
+    def runFailure(self):
+        # status and error text of the exception being handled, for the run log
+        error = sys.exc_info()[1]
+        if isinstance(error, ProcessCancelled):
+            return ('cancelled', None)
+        return ('failed', str(error))
+
+    def startProfile(self):
+        if not self.profile:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def logRun(self, runStart, status, error, profiler=None):
+        """
+        Appends the metrics of every stage and a summary line of the run to the run log
+        """
+        profileFile = None
+        if profiler is not None:
+            profiler.disable()
+            profileFile = os.path.join(os.path.dirname(self.iniFile), 'WFM_Profile.prof')
+            profiler.dump_stats(profileFile)
+
+        if not self.runLog:
+            return
+
+        run = datetime.fromtimestamp(runStart).strftime('%Y-%m-%d %H:%M:%S')
+        records = [dict(stage.record(), run=run) for stage in self.metrics]
+        records.extend([dict(record, run=run) for record in self.shardMetrics])
+        seconds = time.time() - runStart
+        peak = peakMemory()
+        records.append({'run': run,
+                        'stage': 'run',
+                        'status': status,
+                        'error': error,
+                        'datefrom': self.dateFrom,
+                        'dateto': self.dateTo,
+                        'writemode': self.writeMode,
+                        'shards': self.shards,
+                        'seconds': round(seconds, 4),
+                        'rows': self.savedCount,
+                        'rowspersec': round(seconds and self.savedCount / seconds or 0.0, 1),
+                        'exceptions': len(self.exceptions),
+                        'peakmemory': peak and round(peak, 1),
+                        'cachehits': self.cache and self.cache.hits,
+                        'profile': profileFile})
+        try:
+            writeRunLog(self.runLog, records)
+        except IOError, e:
+            # the run itself is done, a run log that cannot be written does not fail it
+            self.setStatus('Cannot write the run log %s: %s' % (self.runLog, e), True)
+
+    def countChanges(self, dateFrom, dateTo):
+        """
+        Returns the number of WFM roster rows of dateFrom to dateTo not synced yet, a quick check before
+        running the whole process. The rows without modification time of the synced days are not counted,
+        they would make every check find changes.
+        """
+        cur = self.connWFM.cursor()
+        query = "select count(*) from roster r join roster_staff rs on r.[key] = rs.roster_key where r.start between ? and ?"
+        (condition, params, changedDays) = self.changeFilter(dateFrom, dateTo, unstamped=False)
+        cur.execute(query + condition, [dateFrom, dateTo] + params)
+        count = cur.fetchone()[0]
+        cur.close()
+        # the read transaction is not kept open between polls
+        self.connWFM.rollback()
+        return count
+
+    def runShards(self, dateFrom, dateTo, overWrite=True):
+        """
+        Runs the process in worker processes, one per shard of the employees with its own engine and
+        connections, then merges their exceptions, timings and counts into this engine.
+        Every shard commits its own work, a failed or cancelled run keeps the shards already finished.
+        """
+        self.dateFrom = dateFrom
+        self.dateTo = dateTo
+        self.overWrite = overWrite
+        self.exceptions = []
+        self.timings = []
+        self.metrics = []
+        self.shardMetrics = []
+        self.savedCount = 0
+        timeStart = time.time()
+        (status, error) = ('ok', None)
+        try:
+            self.runShardJobs(timeStart)
+        except:
+            (status, error) = self.runFailure()
+            raise
+        finally:
+            self.currentStage = None
+            self.logRun(timeStart, status, error)
+
+        return self.timings
+
+    def runShardJobs(self, timeStart):
+        """
+        Truncates the exception table, splits the employees and runs the shards for runShards
+        """
+        self.currentStage = StageMetrics('getShards')
+
+        # truncate the WFM Exception table once, the shards only add to it
+        cur = self.timedCursor(self.connOriTMS)
+        cur.execute('Truncate table dbo.user_wfm_exception')
+        self.connOriTMS.commit()
+
+        self.setStatus('Splitting the employees into %d shards by %s.' % (self.shards, self.shardBy), True)
+        shards = self.getShards()
+        self.stopStage()
+        self.currentStage = StageMetrics('runShards')
+
+        unmatched = set()
+        unmatchedBadges = []
+        lastModify = None
+        finished = 0
+        options = dict((name, getattr(self, name)) for name in self.shardOptions)
+        jobs = [(index, self.iniFile, self.dateFrom, self.dateTo, self.overWrite, shard, options) for (index, shard) in enumerate(shards)]
+        pool = Pool(len(jobs))
+        try:
+            for result in pool.imap_unordered(runShard, jobs):
+                finished += 1
+                self.exceptions.extend(result['exceptions'])
+                self.timings.extend([('shard %d %s' % (result['index'], name), seconds) for (name, seconds) in result['timings']])
+                self.shardMetrics.extend([dict(record, shard=result['index']) for record in result['metrics']])
+                self.savedCount += result['savedCount']
+                unmatchedBadges.extend(result['unmatchedBadges'])
+
+                # a workgroup shard only reads the payrolls of its badges, it has no payroll without badge
+                unmatched.update(result['unmatchedPayrolls'])
+
+                if result['lastModify'] and (lastModify is None or result['lastModify'] > lastModify):
+                    lastModify = result['lastModify']
+
+                self.setStatus('%d of %d shards finished.' % (finished, len(jobs)), True)
+                self.checkCancel()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        # the high-water mark only moves when every shard has committed
+        self.commitWatermark(lastModify)
+
+        if self.shardBy == 'workgroup':
+            unmatched = self.getUnmatchedPayrolls()
+        self.unmatchedPayrolls = sorted(unmatched)
+        self.unmatchedBadges = sorted(unmatchedBadges)
+        self.matchSummary = ' %d WFM payrolls without active badge, %d active badges without WFM roster.' % \
+            (len(self.unmatchedPayrolls), len(self.unmatchedBadges))
+        self.saveRate = self.getSaveRate(self.savedCount, timeStart) + ' %d shards.' % len(jobs) + self.matchSummary
+        self.stopStage()
+
+    def getUnmatchedPayrolls(self):
+        """
+        Returns the set of WFM payrolls of the date range without an active Orisoft badge
+        """
+        cur = self.timedCursor(self.connWFM)
+        cur.execute("select distinct rs.payroll from roster r join roster_staff rs on r.[key] = rs.roster_key " \
+            "where r.start between ? and ?", (self.dateFrom, self.dateTo))
+        payrolls = set(rec[0] for rec in cur.fetchall())
+        cur = self.timedCursor(self.connOriTMS)
+        cur.execute("Select employee_no from employee_badge where employee_status = 'A'")
+        return payrolls.difference(rec[0] for rec in cur.fetchall())
+
+    def getShards(self):
+        """
+        Splits the employees into at most self.shards shards and returns their filters,
+        ('workgroup', codes) balanced on the active badges, or ('payroll', first, end) with about
+        the same number of WFM payrolls in every range, end is None for the last range.
+        """
+        if self.shardBy == 'payroll':
+            cur = self.timedCursor(self.connWFM)
+            cur.execute("select distinct rs.payroll from roster r join roster_staff rs on r.[key] = rs.roster_key " \
+                "where r.start between ? and ? order by rs.payroll", (self.dateFrom, self.dateTo))
+            payrolls = [rec[0] for rec in cur.fetchall()]
+            if not payrolls:
+                return [('payroll', '', None)]
+
+            size = (len(payrolls) + self.shards - 1) // self.shards
+            firsts = payrolls[::size]
+            return [('payroll', first, end) for (first, end) in zip(firsts, firsts[1:] + [None])]
+
+        cur = self.timedCursor(self.connOriTMS)
+        cur.execute("Select work_group_code, count(*) from employee_badge where employee_status = 'A' " \
+            "group by work_group_code order by count(*) desc")
+
+        # the largest workgroups first, each to the shard with the fewest badges so far
+        groups = [[] for index in range(self.shards)]
+        counts = [0] * self.shards
+        for (workgroup, count) in cur.fetchall():
+            index = counts.index(min(counts))
+            groups[index].append(workgroup)
+            counts[index] += count
+
+        return [('workgroup', codes) for codes in groups if codes] or [('workgroup', [None])]
+
+    def badgeFilter(self):
+        """
+        Returns the (condition, params) restricting employee_badge eb to the shard of this engine
+        """
+        if self.shard is None:
+            return ('', [])
+        if self.shard[0] == 'payroll':
+            return self.rangeFilter('eb.employee_no')
+
+        codes = [code for code in self.shard[1] if code is not None]
+        conditions = []
+        if codes:
+            conditions.append('eb.work_group_code in (%s)' % ', '.join(['?'] * len(codes)))
+        if None in self.shard[1]:
+            conditions.append('eb.work_group_code is null')
+        return (' and (%s)' % ' or '.join(conditions), codes)
+
+    def rosterFilter(self, cur):
+        """
+        Returns the (condition, params) restricting roster_staff rs to the shard of this engine. WFM has no
+        workgroups, a workgroup shard loads the payrolls of its badges into #wfm_shard on the cursor
+        """
+        if self.shard is None:
+            return ('', [])
+        if self.shard[0] == 'payroll':
+            return self.rangeFilter('rs.payroll')
+
+        self.loadPayrolls(cur, '#wfm_shard', sorted(self.employees))
+        return (' and exists (select 1 from #wfm_shard p where p.PAYROLL = rs.payroll)', [])
+
+    def rosterByBadges(self):
+        # a workgroup shard reads its badges first, then only the WFM roster of their payrolls
+        return self.shard is not None and self.shard[0] == 'workgroup'
+
+    def changeFilter(self, dateFrom, dateTo, unstamped=True):
+        """
+        Returns (condition, params, changedDays) restricting roster_staff rs of dateFrom to dateTo to the rows
+        not synced yet. The days already synced with the high-water mark, changedDays as (first, last) dates,
+        only have their rows modified since then, and those without modification time if unstamped is True.
+        The other days are read in full.
+        """
+        if self.lastModify is None or self.syncedRange is None:
+            return ('', [], None)
+        first = max(dateFrom, self.syncedRange[0])
+        last = min(dateTo, self.syncedRange[1])
+        if first > last:
+            return ('', [], None)
+
+        condition = " or coalesce(rs.lastModify, rs.current_userdate) > ?"
+        if unstamped:
+            condition += " or coalesce(rs.lastModify, rs.current_userdate) is null"
+        condition = " and (rs.rdate < ? or rs.rdate >= ?%s)" % condition
+        params = [datetime(first.year, first.month, first.day), datetime(last.year, last.month, last.day) + timedelta(1), self.lastModify]
+        return (condition, params, (first, last))
+
+    def rangeFilter(self, column):
+        (first, end) = self.shard[1:]
+        if end is None:
+            return (' and %s >= ?' % column, [first])
+        return (' and %s >= ? and %s < ?' % (column, column), [first, end])
+
+    def cancel(self):
+        # the running stage stops at its next checkCancel call
+        self.cancelRequested = True
+
+    def checkCancel(self):
+        if self.cancelRequested:
+            raise ProcessCancelled()
+
+    def setStatus(self, text, force=False):
+        # progress is sent at most once every statusInterval seconds, so the
+        # cost of reporting it does not grow with the number of rows
+        if self.status is None:
+            return
+
+        now = time.time()
+        if force or now - self.lastStatusTime >= self.statusInterval:
+            self.lastStatusTime = now
+            self.status(text)
+
+    def extract(self):
+        """
+        Loads the Orisoft reference data and the WFM schedules, then matches the schedules to the employees.
+        With parallelExtract every query runs on its own thread and connection, so the extraction
+        takes about as long as the slowest query instead of the sum of all of them.
+        """
+        queries = [('getValidSchedTypes', 'orisoft', self.getValidSchedTypes),
+                   ('getGroupSchedule', 'orisoft', self.getGroupSchedule),
+                   ('getSchedules', 'wfm', self.getSchedules)]
+        lastQuery = ('getActiveEmployees', 'orisoft', self.getActiveEmployees)
+        if self.rosterByBadges():
+            (queries[-1], lastQuery) = (lastQuery, queries[-1])
+
+        # with semiJoin the active employees are restricted to the payrolls fetched from WFM, so they are
+        # loaded once getSchedules is done. A workgroup shard loads its employees first and getSchedules last
+        if self.parallelExtract:
+            pool = ThreadPool(len(queries) + 1)
+            try:
+                results = [pool.apply_async(self.runQuery, (query,)) for query in queries]
+                if self.semiJoin or self.rosterByBadges():
+                    results[-1].get()
+                results.append(pool.apply_async(self.runQuery, (lastQuery,)))
+                queryStages = [result.get() for result in results]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            queryStages = [self.runQuery(query) for query in queries + [lastQuery]]
+
+        # metrics of each extraction query, the extract stage has their totals, with
+        # parallelExtract the queries overlap so its Python time is smaller than the sum of theirs
+        self.metrics.extend(queryStages)
+        self.timings.extend([(stage.name, stage.seconds) for stage in queryStages])
+        for stage in queryStages:
+            self.currentStage.rows += stage.rows
+            self.currentStage.query += stage.query
+            self.currentStage.fetch += stage.fetch
+        self.matchSchedules()
+
+    def runQuery(self, query):
+        """
+        Runs one extraction query (name, database, method) and returns its StageMetrics
+        """
+        (name, database, method) = query
+        stage = StageMetrics(name)
+
+        if not self.parallelExtract:
+            if database == 'orisoft':
+                method(TimedConnection(self.connOriTMS, stage))
+            else:
+                method(TimedConnection(self.connWFM, stage))
+        else:
+            conn = self.checkout(database)
+            try:
+                method(TimedConnection(conn, stage))
+            except:
+                self.checkin(database, conn, True)
+                raise
+            self.checkin(database, conn)
+
+        stage.stop()
+        return stage
+
+    def timedCursor(self, conn):
+        # the statements and fetches of the running stage are timed apart from its Python work
+        if self.currentStage is None:
+            return conn.cursor()
+        return TimedCursor(conn.cursor(), self.currentStage)
+
+    def matchSchedules(self):
+        """
+        Links the active employees to their rows of the WFM schedule matrix
+        """
+        self.unmatchedPayrolls = []
+        for (emp, row) in self.schedules.rows.iteritems():
+            employee = self.employees.get(emp)
+            if employee is not None:
+                employee.sched = row
+                employee.workhours = self.schedules.hours[emp]
+            else:
+                self.unmatchedPayrolls.append(emp)
+        self.unmatchedPayrolls.sort()
+
+        # with semiJoin the badges without roster were read by getActiveEmployees
+        if not self.semiJoin or self.rosterByBadges():
+            self.unmatchedBadges = sorted(emp for (emp, employee) in self.employees.iteritems() if employee.sched is None)
+
+        self.matchSummary = ' %d WFM payrolls without active badge, %d active badges without WFM roster.' % \
+            (len(self.unmatchedPayrolls), len(self.unmatchedBadges))
+
+    def getValidSchedTypes(self, conn):
+        """
+        Creates a list of valid schedule types from Orisoft, or from the cache if schedule_type is unchanged
+        """
+        cur = conn.cursor()
+        codes = None
+        if self.cache is not None:
+            cur.execute("Select count(*), max(schedule_type_code) from schedule_type")
+            signature = tuple(cur.fetchone())
+            codes = self.cache.get('schedule_type', signature)
+
+        if codes is None:
+            cur.execute("Select schedule_type_code from schedule_type")
+            codes = [rec[0] for rec in cur]
+            if self.cache is not None:
+                self.cache.put('schedule_type', signature, codes)
+
+        self.validSchedType.update(codes)
+
+
+
+    def getDaysRange(self):
+        """
+        Creates a list of valid dates from dateFrom to dateTo, and the period (month) index of each day
+        """
+
+        dateFrom = self.dateFrom
+        dateTo = self.dateTo
+
+        self.setStatus('Getting date range', True)
+
+        currDay = dateFrom
+        self.daysRange = []
+        self.periods = []
+        self.dayPeriods = []
+        while currDay <= dateTo:
+            self.daysRange.append(currDay.isoformat())
+            if not self.periods or self.periods[-1] != (currDay.year, currDay.month):
+                self.periods.append((currDay.year, currDay.month))
+            self.dayPeriods.append(len(self.periods) - 1)
+            currDay = currDay + timedelta(1)                # add 1 day to current day
+
+
+
+    def getGroupSchedule(self, conn):
+        """
+        Creates the workgroup -> REFER_ID by period index table from group_schedule_hd,
+        or from the cache if the rows of the periods are unchanged
+        """
+        self.setStatus('Getting Group Schedules', True)
+
+        # work_period_id is a mm/dd/yyyy string, one LIKE 'mm/%/yyyy' per month of the range lets the
+        # server seek on the month prefix of an index instead of converting every row, and works across years
+        periodIndex = {}
+        conditions = []
+        params = []
+        for (index, (year, month)) in enumerate(self.periods):
+            periodIndex[(year, month)] = index
+            conditions.append('work_period_id like ?')
+            params.append('%02d/%%/%d' % (month, year))
+
+        where = ' or '.join(conditions)
+        cur = conn.cursor()
+        recs = None
+        if self.cache is not None:
+            # one cache entry per set of months
+            key = 'group_schedule_hd ' + ' '.join(params)
+            cur.execute("Select count(*), max(id) from group_schedule_hd where " + where, params)
+            signature = tuple(cur.fetchone())
+            recs = self.cache.get(key, signature)
+
+        if recs is None:
+            cur.execute("Select id, work_group, work_period_id from group_schedule_hd where " + where, params)
+            recs = [tuple(rec) for rec in cur]
+            if self.cache is not None:
+                self.cache.put(key, signature, recs)
+
+        for rec in recs:
+            refer_id = rec[0]
+            work_group = rec[1]
+            work_period = rec[2]                # format is mm/dd/yyyy
+
+            (month, day, year) = work_period.split('/')
+            index = periodIndex.get((int(year), int(month)))
+            if index is None:
+                continue
+
+            if work_group not in self.groupSchedule:
+                self.groupSchedule[work_group] = [None] * len(self.periods)
+
+            self.groupSchedule[work_group][index] = refer_id
+
+    def getActiveEmployees(self, conn):
+        cur = conn.cursor()
+        #cur.execute("Select eb.employee_id, eb.employee_no, eb.employee_name from employee_biodata eb, employee_employment ee" \
+        #" where eb.employee_id = ee.employee_id and ee.employee_status = 'A' ")
+        (shardCondition, shardParams) = self.badgeFilter()
+        if not self.semiJoin or self.rosterByBadges():
+            cur.execute("Select eb.employee_no, eb.employee_name, eb.work_group_code from employee_badge eb " \
+                "where eb.employee_status = 'A' " + shardCondition, shardParams)
+            recs = cur.fetchall()
+        else:
+            # push the WFM payrolls to a temp table and join it, so only the badges with a roster are read
+            self.loadPayrolls(cur, '#wfm_payroll', sorted(self.schedules.rows))
+            cur.execute("Select eb.employee_no, eb.employee_name, eb.work_group_code from employee_badge eb " \
+                "join #wfm_payroll p on p.PAYROLL = eb.employee_no where eb.employee_status = 'A' " + shardCondition, shardParams)
+            recs = cur.fetchall()
+
+            cur.execute("Select eb.employee_no from employee_badge eb where eb.employee_status = 'A' " \
+                "and not exists (Select 1 from #wfm_payroll p where p.PAYROLL = eb.employee_no)" + shardCondition + \
+                " order by eb.employee_no", shardParams)
+            self.unmatchedBadges = [rec[0] for rec in cur.fetchall()]
+            cur.execute('Drop table #wfm_payroll')
+
+        for rec in recs:
+            employee_no = rec[0]
+            fullname = rec[1]
+            workgroup = rec[2]
+
+            if fullname.count(',') > 1:
+                (lastname, firstname, whatever) = fullname.split(',', 2)
+            elif fullname.count(',') == 1:
+                (lastname, firstname) = fullname.split(',')
+            else:
+                lastname = fullname
+                firstname = ''
+
+            self.employees[employee_no] = Employee(lastname, firstname, workgroup)
+
+
+    def loadPayrolls(self, cur, table, payrolls):
+        """
+        Creates the session temp table with one PAYROLL column holding payrolls
+        """
+        cur.execute("If object_id('tempdb..%s') is not null drop table %s" % (table, table))
+        cur.execute("Create table %s (PAYROLL varchar(20) collate database_default primary key)" % table)
+        if payrolls:
+            fastExecutemany(cur)
+            cur.executemany("Insert into %s (PAYROLL) VALUES(?)" % table, [(payroll,) for payroll in payrolls])
+
+    def getSchedules(self, conn):
+        """
+        Reads the WFM daily schedules of every payroll into the schedules matrix
+        """
+        dateStart = self.dateFrom
+        dateEnd = self.dateTo
+
+        self.setStatus('Getting schedules from WFM Database.', True)
+
+        cur = conn.cursor()
+        query = "select rs.payroll, rs.rdate, r.shift, rs.start, rs.finish, rs.split, rs.start2, rs.finish2, rs.hours, " \
+            "coalesce(rs.lastModify, rs.current_userdate) " \
+            "from roster r join roster_staff rs on r.[key] = rs.roster_key" \
+            " where r.start between '%s' and '%s'" % (dateStart, dateEnd)
+        (shardCondition, params) = self.rosterFilter(cur)
+        query += shardCondition
+
+        # the new high-water mark is the latest modification actually fetched, not the local clock.
+        # It only replaces the current one once the run is committed, see commitWatermark
+        newLastModify = None
+        self.changedDays = None
+        if self.incremental:
+            # only the roster rows modified in WFM since the last run on the days it synced
+            (changeCondition, changeParams, changedDays) = self.changeFilter(dateStart, dateEnd)
+            query += changeCondition
+            params.extend(changeParams)
+            if changedDays is not None:
+                self.changedDays = ((changedDays[0] - dateStart).days, (changedDays[1] - dateStart).days)
+                newLastModify = self.lastModify
+        cur.execute(query + " order by payroll, rdate", params)
+        unstamped = 0
+        #cur.execute("select rs.payroll, rs.rdate, r.shift, rs.start, rs.finish from roster r join roster_staff rs on r.[key] = rs.roster_key" \
+        #    " where r.start between '%s' and '%s' order by payroll, rdate" % (dateStart.toPython(), dateEnd.toPython()))
+
+        # the active employees may still be loading, the schedules are matched to them by matchSchedules.
+        # The shifts are stored as they are, each distinct one is translated to a schedule type by saveSchedules
+        schedules = ScheduleMatrix(dateStart, len(self.daysRange))
+        while 1:
+            recs = cur.fetchmany(self.batchSize)
+            if not recs:
+                break
+
+            for rec in recs:
+                emp = rec[0]
+                rdate = rec[1].date()
+                shift = tuple(rec[3:9])             # start, finish, split, start2, finish2, hours
+                hours = rec[8]
+                modified = rec[9]
+
+                if modified is None:
+                    unstamped += 1
+                elif newLastModify is None or modified > newLastModify:
+                    newLastModify = modified
+
+                schedules.set(emp, rdate, shift, hours)
+
+            self.setStatus('Fetching schedule of employee : ' + str(emp) + ' from WFM database.')
+            self.checkCancel()
+
+        if self.rosterByBadges():
+            cur.execute('Drop table #wfm_shard')
+
+        self.schedules = schedules
+        self.pendingLastModify = newLastModify
+        self.unstampedRows = unstamped
+
+    # Saves the employees daily schedules to table Employee_Schedule in Orisoft DB
+    def saveSchedules(self):
+
+        # record IDs of employee_schedule are reserved from ofcctrlid by reserveIds when the rows are written
+        cur = self.timedCursor(self.connOriTMS)
+
+        self.setStatus('Saving schedules to Orisoft TMS.', True)
+
+        # schedules are sent to Orisoft in batches of batchSize rows instead of one INSERT per employee-day
+        batch = []
+        savedCount = 0
+        timeStart = time.time()
+
+        # with commitEvery the employees are saved in chunks, each chunk is committed and checkpointed
+        committedCount = 0
+        chunk = []
+        if self.resumeAfter is not None:
+            self.setStatus('Resuming after employee %s.' % self.resumeAfter, True)
+
+        # in upsert mode the batches are loaded into a staging table and applied to employee_schedule in one pass
+        # in diff mode all the schedules are kept until the loop (or chunk) ends, then compared against employee_schedule
+        self.syncSummary = ''
+        self.syncCounts = [0, 0, 0, 0, 0]
+        if self.writeMode == 'upsert':
+            self.createStagingTable(cur)
+            writeBatch = self.stageSchedules
+        elif self.writeMode == 'diff':
+            writeBatch = None
+        else:
+            writeBatch = self.insertSchedules
+
+        # schedule type and validity of every code of the schedule matrix, each distinct shift is translated once
+        translator = ShiftTranslator(self.shiftMap, self.shiftFallback)
+        (codes, validCodes) = translator.translate(self.schedules.codes, self.validSchedType)
+        fallbackCodes = translator.fallbackCodes
+        if translator.invalidMappings:
+            self.matchSummary += ' %d [ShiftMap] entries are not valid schedule types: %s.' % \
+                (len(translator.invalidMappings), ', '.join(translator.invalidMappings))
+        dayPeriods = self.dayPeriods
+
+        # loop through the employees daily schedule matrix
+        for emp in sorted(self.employees):
+            if self.resumeAfter is not None and emp <= self.resumeAfter:
+                continue
+            self.checkCancel()
+            employee = self.employees[emp]
+            if employee.sched is not None:
+                if self.commitEvery and len(chunk) >= self.commitEvery:
+                    committedCount += self.commitChunk(cur, batch, savedCount - committedCount, chunk)
+                    savedCount = committedCount
+                    batch = []
+                    chunk = []
+                    # the staging table is dropped by mergeSchedules, the next chunk needs a new one
+                    if self.writeMode == 'upsert':
+                        self.createStagingTable(cur)
+                chunk.append(emp)
+
+                workgroup = employee.workgroup
+                fullname = employee.fullname()
+                schedType = ''
+                now = datetime.now()
+                created = now.strftime('%Y-%m-%d %H:%M:%S')
+                if workgroup not in self.groupSchedule:
+                    # No WorkGroup schedule
+                    # keep exemption record for the user_wfm_exception table and the report
+                    self.exceptions.append(ScheduleException(emp, fullname, self.daysRange[0], schedType, workgroup, 'No workgroup schedule', 'WFM_IFACE', created))
+                    continue
+
+                # no schedule for a day, assume rest day. The days of an incremental run that only have
+                # the changes are not filled, their missing days are unchanged
+                schedRow = self.schedules.filled(employee.sched, employee.workhours, self.changedDays)
+
+                referIDs = self.groupSchedule[workgroup]
+                for (offset, code) in enumerate(schedRow):
+                    if not code:
+                        continue
+                    currDay = self.daysRange[offset]
+                    schedType = codes[code]
+
+                    # verify schedType if valid
+                    if not validCodes[code]:
+                        # keep exemption record for the user_wfm_exception table and the report
+                        self.exceptions.append(ScheduleException(emp, fullname, currDay, schedType, workgroup, 'ScheduleType is invalid.', 'WFM_IFACE', created))
+                        self.exceptionDays.add((emp, currDay))
+                        continue
+
+                    # get REFER_ID of the day's period from groupSchedule
+                    referID = referIDs[dayPeriods[offset]]
+                    if referID is None:
+                        # No WorkGroup schedule
+                        # keep exemption record for the user_wfm_exception table and the report
+                        self.exceptions.append(ScheduleException(emp, fullname, currDay, schedType, workgroup, 'No workgroup schedule', 'WFM_IFACE', created))
+                        self.exceptionDays.add((emp, currDay))
+                        continue
+
+                    if code in fallbackCodes:
+                        # saved, but reported so the guessed schedule type can be checked
+                        self.exceptions.append(ScheduleException(emp, fullname, currDay, schedType, workgroup, 'ScheduleType guessed.', 'WFM_IFACE', created))
+
+                    batch.append((referID, emp, currDay, schedType, created))
+                    if writeBatch and len(batch) >= self.batchSize:
+                        savedCount += writeBatch(cur, batch)
+                        batch = []
+                        self.showSaveRate(savedCount, timeStart)
+
+        savedCount = committedCount + self.commitChunk(cur, batch, savedCount - committedCount, chunk)
+        self.clearCheckpoint()
+        self.savedCount = savedCount
+        self.saveRate = self.getSaveRate(savedCount, timeStart) + self.syncSummary + self.matchSummary
+        if self.incremental and self.unstampedRows:
+            self.saveRate += ' %d WFM rows without modification time, they are read by every incremental run.' % self.unstampedRows
+
+    def commitChunk(self, cur, batch, writtenCount, payrolls):
+        """
+        Writes the pending batch and exception records, commits them and checkpoints the last of payrolls.
+        writtenCount is the number of rows of the chunk already sent by the batch writes.
+        Returns the number of schedule rows saved by the chunk.
+        """
+        if self.writeMode == 'diff':
+            # a chunk only compares the existing schedules of its own employees
+            if self.commitEvery:
+                writtenCount = self.syncSchedules(cur, batch, payrolls)
+            else:
+                writtenCount = self.syncSchedules(cur, batch)
+        else:
+            if batch and self.writeMode == 'upsert':
+                writtenCount += self.stageSchedules(cur, batch)
+            elif batch:
+                writtenCount += self.insertSchedules(cur, batch)
+            if self.writeMode == 'upsert':
+                writtenCount = self.mergeSchedules(cur)
+
+        self.saveExceptions(cur, self.savedExceptions)
+        self.savedExceptions = len(self.exceptions)
+
+        self.connOriTMS.commit()
+        if payrolls:
+            self.saveCheckpoint(payrolls[-1])
+        return writtenCount
+
+    def insertSchedules(self, cur, batch):
+        """
+        Inserts a batch of (REFER_ID, BADGE_NO, SCHEDULE_DATE, SCHEDULE_TYPE, CREATED_DATE) rows
+        into employee_schedule using a single parameterized executemany.
+        The record IDs are a block reserved for the batch, the IDs of the rows not saved are given back.
+        Returns the number of rows saved.
+        """
+        query = "INSERT INTO employee_schedule (ID, REFER_ID, BADGE_NO, EMPLOYEE_NO, SCHEDULE_DATE, SEQ_NO, SCHEDULE_TYPE, CREATED_BY, CREATED_DATE)" \
+            " VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+        firstID = self.reserveIds(len(batch))
+        currID = firstID
+
+        params = []
+        nextID = firstID
+        for (referID, emp, currDay, schedType, created) in batch:
+            params.append((nextID, referID, emp, emp, currDay, 1, schedType, 'WFM_IFACE', created))
+            nextID += 1
+
+        fastExecutemany(cur)
+
+        # the savepoint lets a batch with duplicate records be undone without losing the previous batches.
+        # SAVE TRANSACTION does not open the implicit transaction of the driver, after a commit (a chunk,
+        # a shard or a new connection) the first statement on the connection may be this one. A select
+        # opens it at @@TRANCOUNT 1 like any other statement, so commit() still ends it
+        cur.execute('Select top 0 ID from employee_schedule')
+        cur.execute('SAVE TRANSACTION wfm_batch')
+        try:
+            cur.executemany(query, params)
+            return len(params)
+        except self.integrityError():
+            cur.execute('ROLLBACK TRANSACTION wfm_batch')
+
+        # the batch contains records already in Orisoft, save it one row at a time
+        savedCount = 0
+        for (referID, emp, currDay, schedType, created) in batch:
+            # repeatCount variable is used to avert an infinite loop, the while loop will exit if the value is more than 1
+            repeatCount = 0
+            while 1:
+                repeatCount += 1
+                try:
+                    cur.execute(query, (currID, referID, emp, emp, currDay, 1, schedType, 'WFM_IFACE', created))
+                    currID += 1
+                    savedCount += 1
+                    break;
+                except self.integrityError(), e:
+                   # Duplicate record error
+                   # check the overwrite data checkbox
+                   if self.overWrite:
+                       cur.execute("Delete from EMPLOYEE_SCHEDULE where BADGE_NO = ? and SCHEDULE_DATE = ? and SEQ_NO = ?", (emp, currDay, 1))
+                   else:
+                       break
+
+                   # check if repeated already
+                   if repeatCount > 1:
+                       break
+
+        # the saved rows have the first IDs of the block, the duplicates keep none
+        if savedCount < len(batch):
+            self.releaseIds(firstID + len(batch), currID)
+        return savedCount
+
+    def createStagingTable(self, cur):
+        """
+        Creates the session temp table #wfm_schedule that holds the computed schedules of an upsert run
+        """
+        cur.execute("If object_id('tempdb..#wfm_schedule') is not null drop table #wfm_schedule")
+        # columns are kept as varchar so values are converted exactly as the direct INSERT converts them
+        cur.execute("Create table #wfm_schedule (REFER_ID varchar(30), BADGE_NO varchar(20) collate database_default, " \
+            "SCHEDULE_DATE varchar(10), SCHEDULE_TYPE varchar(20) collate database_default, CREATED_DATE varchar(19))")
+
+    def stageSchedules(self, cur, batch):
+        """
+        Loads a batch of (REFER_ID, BADGE_NO, SCHEDULE_DATE, SCHEDULE_TYPE, CREATED_DATE) rows into #wfm_schedule.
+        No record ID is used yet, IDs are assigned by mergeSchedules.
+        """
+        fastExecutemany(cur)
+
+        cur.executemany("Insert into #wfm_schedule (REFER_ID, BADGE_NO, SCHEDULE_DATE, SCHEDULE_TYPE, CREATED_DATE) " \
+            "VALUES(?, ?, ?, ?, ?)", batch)
+        return len(batch)
+
+    def mergeSchedules(self, cur):
+        """
+        Applies #wfm_schedule to employee_schedule with one ranged DELETE (if overwrite is checked)
+        and one INSERT ... SELECT of the schedules not yet in Orisoft.
+        Returns the number of rows inserted.
+        """
+        self.setStatus('Applying staged schedules to Orisoft TMS.', True)
+
+        if self.overWrite:
+            cur.execute("Delete es from employee_schedule es join #wfm_schedule s " \
+                "on es.BADGE_NO = s.BADGE_NO and es.SCHEDULE_DATE = s.SCHEDULE_DATE and es.SEQ_NO = 1")
+
+        # reserve the IDs of the rows to insert, they are numbered from the first one in badge/date order
+        cur.execute("Select count(*) from #wfm_schedule s where not exists (Select 1 from employee_schedule es " \
+            "where es.BADGE_NO = s.BADGE_NO and es.SCHEDULE_DATE = s.SCHEDULE_DATE and es.SEQ_NO = 1)")
+        newCount = cur.fetchone()[0]
+        if not newCount:
+            cur.execute('Drop table #wfm_schedule')
+            return 0
+        currID = self.reserveIds(newCount)
+
+        cur.execute("INSERT INTO employee_schedule (ID, REFER_ID, BADGE_NO, EMPLOYEE_NO, SCHEDULE_DATE, SEQ_NO, SCHEDULE_TYPE, CREATED_BY, CREATED_DATE) " \
+            "Select ? + row_number() over (order by s.BADGE_NO, s.SCHEDULE_DATE) - 1, s.REFER_ID, s.BADGE_NO, s.BADGE_NO, " \
+            "s.SCHEDULE_DATE, 1, s.SCHEDULE_TYPE, 'WFM_IFACE', s.CREATED_DATE from #wfm_schedule s " \
+            "where not exists (Select 1 from employee_schedule es " \
+            "where es.BADGE_NO = s.BADGE_NO and es.SCHEDULE_DATE = s.SCHEDULE_DATE and es.SEQ_NO = 1)", (currID,))
+        insertedCount = cur.rowcount
+
+        cur.execute('Drop table #wfm_schedule')
+        return insertedCount
+
+    def syncSchedules(self, cur, schedules, payrolls=None):
+        """
+        Compares the computed (REFER_ID, BADGE_NO, SCHEDULE_DATE, SCHEDULE_TYPE, CREATED_DATE) rows with
+        the employee_schedule rows already in Orisoft for the date range and writes only the differences.
+        Only the existing rows of payrolls are compared when given, else those of every employee.
+        Returns the number of rows written.
+        """
+        self.setStatus('Reading existing schedules from Orisoft TMS.', True)
+
+        existing = {}
+        query = "Select es.ID, es.BADGE_NO, es.SCHEDULE_DATE, es.SCHEDULE_TYPE, es.REFER_ID, es.CREATED_BY from employee_schedule es "
+        if payrolls is not None:
+            if not payrolls:
+                return 0
+            self.loadPayrolls(cur, '#wfm_chunk', payrolls)
+            query += "join #wfm_chunk p on p.PAYROLL = es.BADGE_NO "
+
+        # read the existing schedules of the whole date range in one query
+        cur.execute(query + "where es.SCHEDULE_DATE between ? and ? and es.SEQ_NO = 1", (self.daysRange[0], self.daysRange[-1]))
+        for rec in cur.fetchall():
+            existing[(rec[1], rec[2].date().isoformat())] = (rec[0], rec[3], rec[4], rec[5])
+        if payrolls is not None:
+            cur.execute('Drop table #wfm_chunk')
+
+        newRows = []
+        changedRows = []
+        unchangedCount = 0
+        changedCount = 0
+        for row in schedules:
+            (referID, emp, currDay, schedType, created) = row
+            old = existing.pop((emp, currDay), None)
+            if old is None:
+                newRows.append(row)
+            elif old[1] == schedType and str(old[2]) == str(referID):
+                unchangedCount += 1
+            else:
+                changedCount += 1
+                changedRows.append((schedType, referID, old[0]))
+
+        # rows left in existing are not in the computed schedules, only the ones created by this interface
+        # on a day without WFM schedule are treated as removed. The days that raised an exception and the
+        # employees without workgroup schedule keep their rows, as in the other write modes, and the days
+        # of an incremental run that only have the changes are left as they are.
+        removedRows = []
+        changedOnly = set()
+        if self.changedDays is not None:
+            changedOnly = set(self.daysRange[self.changedDays[0]:self.changedDays[1] + 1])
+        for ((emp, currDay), old) in existing.iteritems():
+            if old[3] != 'WFM_IFACE' or currDay in changedOnly or (emp, currDay) in self.exceptionDays:
+                continue
+            employee = self.employees.get(emp)
+            if employee is not None and employee.sched is not None and employee.workgroup in self.groupSchedule:
+                removedRows.append((old[0],))
+
+        self.setStatus('Saving schedule changes to Orisoft TMS.', True)
+
+        fastExecutemany(cur)
+
+        # existing records are only changed or removed when overwrite is checked, else they are counted as not overwritten
+        savedCount = 0
+        keptCount = 0
+        if self.overWrite:
+            if changedRows:
+                cur.executemany("Update employee_schedule set SCHEDULE_TYPE = ?, REFER_ID = ? where ID = ?", changedRows)
+                savedCount += len(changedRows)
+            if removedRows:
+                cur.executemany("Delete from employee_schedule where ID = ?", removedRows)
+                savedCount += len(removedRows)
+        else:
+            keptCount = changedCount + len(removedRows)
+            changedCount = 0
+            removedRows = []
+
+        # each batch reserves its own IDs, so the IDs of the rows it could not save are given back
+        for i in range(0, len(newRows), self.batchSize):
+            savedCount += self.insertSchedules(cur, newRows[i:i + self.batchSize])
+
+        # the counts of all the chunks of the run
+        for (index, count) in enumerate((unchangedCount, changedCount, len(newRows), len(removedRows), keptCount)):
+            self.syncCounts[index] += count
+        self.syncSummary = ' Unchanged %d, changed %d, new %d, removed %d, not overwritten %d.' % tuple(self.syncCounts)
+        return savedCount
+
+    def getSaveRate(self, savedCount, timeStart):
+        elapsed = time.time() - timeStart
+        if elapsed > 0:
+            rate = savedCount / elapsed
+        else:
+            rate = 0.0
+
+        return '%d schedules saved in %.1f secs (%.0f rows/sec).' % (savedCount, elapsed, rate)
+
+    def showSaveRate(self, savedCount, timeStart):
+        self.setStatus('Saving schedules to Orisoft TMS. ' + self.getSaveRate(savedCount, timeStart))
+
+    def saveExceptions(self, cur, start=0):
+        """
+        Writes the exception records of the run from index start to user_wfm_exception in batches
+        """
+        if len(self.exceptions) <= start:
+            return
+
+        self.setStatus('Saving %d exception records to Orisoft TMS.' % (len(self.exceptions) - start), True)
+        fastExecutemany(cur)
+
+        query = "Insert into user_wfm_exception(EMPLOYEE_NO, EMPLOYEE_NAME, SCHEDULE_DATE, SCHEDULE_TYPE, WORK_GROUP, REMARKS, CREATED_BY, CREATED_DATE) " \
+            "VALUES(?, ?, ?, ?, ?, ?, ?, ?)"
+        for i in range(start, len(self.exceptions), self.batchSize):
+            cur.executemany(query, self.exceptions[i:i + self.batchSize])
+
+    def loadExceptions(self):
+        """
+        Reads back the exception records committed by the failed run that is resumed
+        """
+        cur = self.connOriTMS.cursor()
+        cur.execute("Select EMPLOYEE_NO, EMPLOYEE_NAME, SCHEDULE_DATE, SCHEDULE_TYPE, WORK_GROUP, REMARKS, CREATED_BY, CREATED_DATE " \
+            "from user_wfm_exception")
+        for rec in cur.fetchall():
+            # dates are kept as the same strings the run itself records
+            values = list(rec)
+            if hasattr(values[2], 'date'):
+                values[2] = values[2].date().isoformat()
+            if hasattr(values[7], 'strftime'):
+                values[7] = values[7].strftime('%Y-%m-%d %H:%M:%S')
+            self.exceptions.append(ScheduleException(*values))
+        self.savedExceptions = len(self.exceptions)
+
+    def getExceptionReport(self):
+        """
+        Returns the exception records of the last run as report lines, ordered by employee name and schedule date
+        """
+        exceptionReport = [list(exception) for exception in self.exceptions]
+        exceptionReport.sort(key=lambda line: (line[1], line[2]))
+        return exceptionReport
+
+
+def runShard(job):
+    """
+    Worker process of WFMEngine.runShards, runs the process for one shard with its own engine and connections
+    """
+    (index, iniFile, dateFrom, dateTo, overWrite, shard, options) = job
+    engine = WFMEngine(iniFile)
+    engine.readIni()
+    for (name, value) in options.items():
+        setattr(engine, name, value)
+    engine.shard = shard
+    # the coordinator logs the metrics of every shard, the workers would all append to the same files
+    engine.runLog = None
+    engine.profile = False
+    engine.connect()
+    try:
+        engine.run(dateFrom, dateTo, overWrite, truncate=False)
+    finally:
+        engine.close()
+
+    return {'index': index,
+            'exceptions': engine.exceptions,
+            'timings': engine.timings,
+            'metrics': [stage.record() for stage in engine.metrics],
+            'savedCount': engine.savedCount,
+            'unmatchedPayrolls': engine.unmatchedPayrolls,
+            'unmatchedBadges': engine.unmatchedBadges,
+            'lastModify': engine.pendingLastModify}
@@ -0,0 +1,98 @@
+#***********************************
+# Program Name : WFMExport.py
+# Description  : writes the WFM interface exception report to CSV or fixed-width text files,
+#                optionally gzip compressed, for the report window and the WFM_Batch --report option.
+#************************************
+
+from WFMSchedule import exceptionHeader
+
+# column widths of the fixed-width text report, longer values are cut
+exceptionWidths = [12, 40, 13, 13, 12, 30, 12, 19]
+
+
+def text(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def cell(value, width):
+    # pad and cut as unicode so multi-byte names keep the column alignment
+    if value is None:
+        value = u''
+    elif not isinstance(value, unicode):
+        value = str(value).decode('utf-8', 'replace')
+    return value[:width].ljust(width + 1)
+
+
+def openReport(filename):
+    # a .gz file name is compressed on the fly
+    if filename.lower().endswith('.gz'):
+        import gzip
+        return gzip.open(filename, 'wb')
+    return open(filename, 'wb')
+
+
+def reportFormat(filename):
+    """
+    Returns 'txt' or 'csv' from the file name extension, .gz is not counted
+    """
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.txt'):
+        return 'txt'
+    return 'csv'
+
+
+def exportReport(rows, filename, header=exceptionHeader, format=None, widths=exceptionWidths):
+    """
+    Writes rows to filename as csv or fixed-width txt and returns the number of rows written.
+    rows can be any iterable, it is read one row at a time so memory use does not depend on its size.
+    """
+    if format is None:
+        format = reportFormat(filename)
+
+    count = 0
+    outf = openReport(filename)
+    try:
+        if format == 'txt':
+            line = u''.join([cell(title, width) for (title, width) in zip(header, widths)])
+            outf.write(line.rstrip().encode('utf-8') + '\r\n')
+            outf.write(''.join(['-' * width + ' ' for width in widths]).rstrip() + '\r\n')
+            for row in rows:
+                line = u''.join([cell(value, width) for (value, width) in zip(row, widths)])
+                outf.write(line.rstrip().encode('utf-8') + '\r\n')
+                count += 1
+        else:
+            import csv
+            writer = csv.writer(outf, delimiter=',', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
+            #write column headers
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow([text(value) for value in row])
+                count += 1
+    finally:
+        outf.close()
+
+    return count
+
+
+def iterExceptionTable(conn, chunkSize=1000):
+    """
+    Yields the rows of USER_WFM_EXCEPTION, fetched chunkSize rows at a time
+    """
+    cursor = conn.cursor()
+    cursor.execute("Select EMPLOYEE_NO, EMPLOYEE_NAME, SCHEDULE_DATE, SCHEDULE_TYPE, WORK_GROUP, REMARKS, CREATED_BY, CREATED_DATE " \
+        "from USER_WFM_EXCEPTION order by EMPLOYEE_NAME, SCHEDULE_DATE")
+    try:
+        while 1:
+            recs = cursor.fetchmany(chunkSize)
+            if not recs:
+                break
+            for rec in recs:
+                yield rec
+    finally:
+        cursor.close()
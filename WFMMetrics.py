@@ -0,0 +1,180 @@
+#***********************************
+# Program Name : WFMMetrics.py
+# Description  : per-stage wall, query, fetch and Python time, row counts and peak memory of a WFMEngine run,
+#                written as JSON lines to the run log.
+#************************************
+
+import sys
+import json
+import time
+import ctypes
+
+try:
+    import resource
+except ImportError:
+    resource = None             # not on Windows
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    # PROCESS_MEMORY_COUNTERS of GetProcessMemoryInfo, the sizes are SIZE_T
+    _fields_ = [('cb', ctypes.c_ulong),
+                ('PageFaultCount', ctypes.c_ulong),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)]
+
+
+def peakMemory():
+    """
+    Returns the peak resident memory of the process in MB, or None if it cannot be read
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on Mac OS X
+        if sys.platform == 'darwin':
+            return peak / 1048576.0
+        return peak / 1024.0
+
+    if sys.platform == 'win32':
+        # the peak working set, read from psapi as there is no resource module on Windows
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 1048576.0
+        return None
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    # other platforms without resource only have the current rss
+    return psutil.Process().memory_info().rss / 1048576.0
+
+
+class StageMetrics(object):
+    """
+    Wall time, database statement and fetch time and row count of one process stage.
+    rows are the rows fetched by the stage, or the rows written for the save stage.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.timeStart = time.time()
+        self.seconds = 0.0
+        self.query = 0.0                # seconds spent in execute and executemany
+        self.fetch = 0.0                # seconds spent in fetchone, fetchmany, fetchall and iteration
+        self.rows = 0
+        self.peakMemory = None
+
+    def stop(self, rows=None):
+        self.seconds = time.time() - self.timeStart
+        if rows is not None:
+            self.rows = rows
+        self.peakMemory = peakMemory()
+
+    def record(self):
+        """
+        Returns the metrics as a dict for the run log, the Python time is what is left of the wall time
+        """
+        return {'stage': self.name,
+                'seconds': round(self.seconds, 4),
+                'rows': self.rows,
+                'rowspersec': round(self.seconds and self.rows / self.seconds or 0.0, 1),
+                'query': round(self.query, 4),
+                'fetch': round(self.fetch, 4),
+                'python': round(max(self.seconds - self.query - self.fetch, 0.0), 4),
+                'peakmemory': self.peakMemory and round(self.peakMemory, 1)}
+
+
+class TimedCursor(object):
+    """
+    Cursor wrapper adding the time of the statements and of the fetches to a StageMetrics
+    """
+    def __init__(self, cursor, stage):
+        # set through __dict__, every other attribute is the cursor's (fast_executemany, rowcount)
+        self.__dict__['cursor'] = cursor
+        self.__dict__['stage'] = stage
+
+    def execute(self, *args):
+        timeStart = time.time()
+        try:
+            self.cursor.execute(*args)
+        finally:
+            self.stage.query += time.time() - timeStart
+        return self
+
+    def executemany(self, *args):
+        timeStart = time.time()
+        try:
+            self.cursor.executemany(*args)
+        finally:
+            self.stage.query += time.time() - timeStart
+
+    def fetchone(self):
+        timeStart = time.time()
+        rec = self.cursor.fetchone()
+        self.stage.fetch += time.time() - timeStart
+        if rec is not None:
+            self.stage.rows += 1
+        return rec
+
+    def fetchmany(self, size):
+        timeStart = time.time()
+        recs = self.cursor.fetchmany(size)
+        self.stage.fetch += time.time() - timeStart
+        self.stage.rows += len(recs)
+        return recs
+
+    def fetchall(self):
+        timeStart = time.time()
+        recs = self.cursor.fetchall()
+        self.stage.fetch += time.time() - timeStart
+        self.stage.rows += len(recs)
+        return recs
+
+    def __iter__(self):
+        # fetched in chunks so the fetch time is not measured on every row
+        while 1:
+            recs = self.fetchmany(1000)
+            if not recs:
+                break
+            for rec in recs:
+                yield rec
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.cursor, name, value)
+
+
+class TimedConnection(object):
+    """
+    Connection wrapper whose cursors are TimedCursors of stage
+    """
+    def __init__(self, conn, stage):
+        self.conn = conn
+        self.stage = stage
+
+    def cursor(self):
+        return TimedCursor(self.conn.cursor(), self.stage)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def writeRunLog(filename, records):
+    """
+    Appends the records to the JSON-lines run log filename, one line per record
+    """
+    log = open(filename, 'a')
+    try:
+        for record in records:
+            log.write(json.dumps(record, default=str) + '\n')
+    finally:
+        log.close()
@@ -0,0 +1,96 @@
+#***********************************
+# Program Name : WFMPool.py
+# Description  : pool of reusable database connections with health checks, used by the WFM_Service runs
+#                so the connections are not opened again on every poll.
+#************************************
+
+import threading
+import time
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to size idle connections made by connect.
+
+    A connection idle for more than checkAge seconds is tested with healthQuery before it is handed
+    out, a connection that fails the test or is released as broken is closed and replaced by a new one.
+    """
+    def __init__(self, connect, size=4, errors=(Exception,), healthQuery='Select 1', checkAge=30):
+        self.connect = connect
+        self.size = size
+        self.errors = errors                    # exceptions of a dead connection
+        self.healthQuery = healthQuery
+        self.checkAge = checkAge
+        self.idle = []                          # (connection, time released)
+        self.lock = threading.Lock()
+        self.opened = 0                         # connections made, for the service statistics
+        self.replaced = 0                       # connections closed by a failed health check
+
+    def acquire(self):
+        """
+        Returns a healthy connection, an idle one if there is one else a new one
+        """
+        while 1:
+            self.lock.acquire()
+            try:
+                if not self.idle:
+                    break
+                (conn, released) = self.idle.pop()
+            finally:
+                self.lock.release()
+
+            if time.time() - released < self.checkAge or self.isHealthy(conn):
+                return conn
+            self.replaced += 1
+            self.discard(conn)
+
+        conn = self.connect()
+        self.opened += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        """
+        Returns conn to the pool, a broken connection or one over the pool size is closed
+        """
+        if not broken:
+            try:
+                # nothing left uncommitted is carried over to the next user
+                conn.rollback()
+            except self.errors:
+                broken = True
+
+        self.lock.acquire()
+        try:
+            if not broken and len(self.idle) < self.size:
+                self.idle.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        self.discard(conn)
+
+    def isHealthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute(self.healthQuery)
+            cur.fetchall()
+            cur.close()
+            return True
+        except self.errors:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except self.errors:
+            pass
+
+    def closeAll(self):
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.lock.release()
+
+        for (conn, released) in idle:
+            self.discard(conn)
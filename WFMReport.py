@@ -1,34 +1,89 @@
 import sys
 from PySide.QtCore import *
 from PySide.QtGui import *
-import csv
+from WFMExport import exportReport
+
+
+class WFMReportModel(QAbstractTableModel):
+    """
+    Read-only table model over data_list, the cell text is only built when the view asks for it
+    """
+    def __init__(self, data_list, header, parent=None):
+        super(WFMReportModel, self).__init__(parent)
+        self.data_list = data_list
+        self.header = header
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.data_list)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.header)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == Qt.DisplayRole:
+            return '%s' % (self.data_list[index.row()][index.column()])
+        elif role == Qt.TextAlignmentRole:
+            # align center all cell text
+            return Qt.AlignCenter
+
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.header[section]
+
+        return None
+
 
 class WfmReport(QDialog):
+
+    # number of rows used to estimate the column widths
+    sampleRows = 200
+
     def __init__(self, data_list, header, parent=None):
         super(WfmReport, self).__init__(parent)
 
-        #self.table_model = WFMReportModel(self, data_list, header)
         self.data_list = data_list
         self.header = header
         self.table_view = QTableView(self)
-        self.table_model = QStandardItemModel(len(data_list), len(header), self.table_view)
+        self.table_model = WFMReportModel(data_list, header, self.table_view)
+
+        # sorting and filtering are done by the proxy, the source rows are never copied
+        self.proxy_model = QSortFilterProxyModel(self.table_view)
+        self.proxy_model.setSourceModel(self.table_model)
+        self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy_model.setFilterKeyColumn(-1)
 
-        # set header
-        for i in range(len(header)):
-            self.table_model.setHeaderData(i, Qt.Horizontal, header[i])
+        self.table_view.setModel(self.proxy_model)
+        # setSortingEnabled sorts by the sort indicator at once, with no indicator column the rows
+        # keep the employee name and date order of the report until a header is clicked
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.horizontalHeader().setSortIndicatorShown(True)
+        self.setColumnWidths()
 
-        for row in range(len(data_list)):
-            for col in range(len(header)):
-                item = QStandardItem('%s' % (data_list[row][col]))
-                item.setTextAlignment(Qt.AlignCenter)
-                self.table_model.setItem(row, col, item)
+        # filter the report by the text in one column or in all columns
+        self.filterColumn = QComboBox()
+        self.filterColumn.addItem('All columns')
+        self.filterColumn.addItems(header)
+        self.filterText = QLineEdit()
+        self.labelRows = QLabel('')
+        layoutFilter = QHBoxLayout()
+        layoutFilter.addWidget(QLabel('Filter'))
+        layoutFilter.addWidget(self.filterColumn)
+        layoutFilter.addWidget(self.filterText)
+        layoutFilter.addWidget(self.labelRows)
 
-        self.table_view.setModel(self.table_model)
-        self.table_view.resizeColumnsToContents()
         btnSaveAs = QPushButton('Save As')
         btnExit = QPushButton('Exit')
         layoutButton = QHBoxLayout()
-        #self.table_view.setSortingEnabled(True)
 
         #layoutButton.addSpacing(200)
         layoutButton.addStretch()
@@ -38,42 +93,53 @@ class WfmReport(QDialog):
         #layoutButton.addItem(QSpacerItem(200,1), 0, 3)
 
         layout = QVBoxLayout(self)
+        layout.addLayout(layoutFilter)
         layout.addWidget(self.table_view)
         layout.addLayout(layoutButton)
         self.setLayout(layout)
 
         btnSaveAs.clicked.connect(self.saveFile)
         btnExit.clicked.connect(self.exit)
+        self.filterText.textChanged.connect(self.setFilter)
+        self.filterColumn.currentIndexChanged.connect(self.setFilter)
+        self.showRowCount()
 
-        # align center all cell text
-        #self.setAlignment(Qt.AlignmentFlag.AlignCenter)
+    def setColumnWidths(self):
+        # estimate the widths from the header and a sample of the rows instead of resizeColumnsToContents,
+        # which measures every cell of the report
+        metrics = self.table_view.fontMetrics()
+        sample = self.data_list[:self.sampleRows]
+        for col in range(len(self.header)):
+            width = metrics.width(self.header[col])
+            for row in sample:
+                width = max(width, metrics.width('%s' % (row[col])))
+            self.table_view.setColumnWidth(col, width + 20)
+
+    def setFilter(self):
+        # combo box index 0 is all columns, the other indexes are the report columns
+        self.proxy_model.setFilterKeyColumn(self.filterColumn.currentIndex() - 1)
+        self.proxy_model.setFilterFixedString(self.filterText.text())
+        self.showRowCount()
+
+    def showRowCount(self):
+        self.labelRows.setText('%d of %d rows' % (self.proxy_model.rowCount(), len(self.data_list)))
 
     def saveFile(self):
         filename,filter = QFileDialog.getSaveFileName(self, "Save Report",'',"CSV File (*.csv);; Text File (*.txt)")
+        if not filename:
+            return
+
         if filter.startswith("CSV"):
-            outf = open(filename, "wb")
-            writer = csv.writer(outf, delimiter=',', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
-            #write column headers
-            writer.writerow(self.header)
-            for row in self.data_list:
-                writer.writerow(row)
+            format = 'csv'
         else:
-            pass
+            format = 'txt'
 
-        print "filename =", filename
-        print "filter = ", filter
+        try:
+            exportReport(self.data_list, filename, self.header, format)
+        except IOError, e:
+            QMessageBox.critical(self, 'Save Report Error', str(e))
 
     def exit(self):
         self.close()
         self.reject()
 
-    def setAlignment(self, alignment):
-        r = 0
-        for row in range(self.table_model.rowCount(self)):
-            c = 0
-            for col in range(self.table_model.columnCount(self)):
-                self.table_view.item(r, c).setTextAlignment(alignment)
-                c += 1
-            r += 1
-
-
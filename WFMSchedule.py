@@ -0,0 +1,195 @@
+#***********************************
+# Program Name : WFMSchedule.py
+# Description  : compact in-memory storage of the employees and their daily schedules
+#************************************
+
+import re
+from array import array
+from collections import namedtuple
+
+
+# a record of the user_wfm_exception table
+ScheduleException = namedtuple('ScheduleException', ['employee_no', 'employee_name', 'schedule_date', 'schedule_type',
+    'work_group', 'remarks', 'created_by', 'created_date'])
+
+# column titles of the exception report
+exceptionHeader = ['EMPLOYEE NO', 'EMPLOYEE NAME', 'SCHEDULE DATE', 'SCHEDULE_TYPE', 'WORKGROUP', 'REMARKS', 'CREATED BY', 'CREATED DATE']
+
+
+class Employee(object):
+    """
+    An active Orisoft employee, sched is the employee's row of the ScheduleMatrix
+    """
+    __slots__ = ('lastname', 'firstname', 'workgroup', 'workhours', 'sched')
+
+    def __init__(self, lastname='', firstname='', workgroup=None):
+        self.lastname = lastname
+        self.firstname = firstname
+        self.workgroup = workgroup
+        self.workhours = 9
+        self.sched = None
+
+    def fullname(self):
+        return self.lastname + ', ' + self.firstname
+
+
+class ScheduleMatrix(object):
+    """
+    Shifts of payroll x day offset from dateStart.
+
+    Each payroll has one array of small ints with an entry per day. 0 means no schedule,
+    any other value is an index into codes, so every distinct shift is stored once.
+    A code is a WFM shift tuple or, for the rest days, a schedule type.
+    """
+    # rest day schedule type by work hours, any other work hours is REST
+    restTypes = {9: 'RD08', 12: 'RD11'}
+
+    def __init__(self, dateStart, days):
+        self.dateStart = dateStart
+        self.days = days
+        self.codes = [None]                     # shift or schedule type of each code, code 0 is no schedule
+        self.codeIndex = {}                     # code of each shift or schedule type
+        self.rows = {}                          # payroll -> array of codes by day offset
+        self.hours = {}                         # payroll -> work hours of the payroll's last schedule
+
+        # the rest day types get their codes up front so validFlags covers them
+        self.codeOf('REST')
+        for schedType in self.restTypes.values():
+            self.codeOf(schedType)
+
+    def codeOf(self, shift):
+        code = self.codeIndex.get(shift)
+        if code is None:
+            code = len(self.codes)
+            self.codes.append(shift)
+            self.codeIndex[shift] = code
+        return code
+
+    def set(self, payroll, rdate, shift, hours):
+        """
+        Stores the shift of payroll on rdate, days outside of the range are ignored
+        """
+        offset = (rdate - self.dateStart).days
+        if offset < 0 or offset >= self.days:
+            return
+
+        row = self.rows.get(payroll)
+        if row is None:
+            row = self.rows[payroll] = array('H', [0]) * self.days
+        row[offset] = self.codeOf(shift)
+        self.hours[payroll] = hours
+
+    def restCode(self, workhours):
+        return self.codeIndex[self.restTypes.get(workhours, 'REST')]
+
+    def filled(self, row, workhours, changedDays=None):
+        """
+        Returns a copy of row with the days without schedule set to the rest day code of workhours,
+        except the days of the (first, last) offsets changedDays that only have the changed schedules
+        """
+        restCode = self.restCode(workhours)
+        filled = [code or restCode for code in row]
+        if changedDays is not None:
+            (first, last) = changedDays
+            filled[first:last + 1] = row[first:last + 1]
+        return filled
+
+
+def hhmm(value):
+    # WFM keeps the shift times on 1899-12-30, which strftime does not accept
+    return '%02d%02d' % (value.hour, value.minute)
+
+
+class ShiftTranslator(object):
+    """
+    Translates the WFM shifts (start, finish, split, start2, finish2, hours) to Orisoft schedule types.
+
+    Every distinct shift is translated once per run. Its candidates are tried in order and the first
+    valid schedule type is used: the shiftMap entry of its exact times (hhmm-hhmm, or hhmm-hhmm/hhmm-hhmm
+    for a split shift), the entry of the whole span of a split shift, then the hour code of its start and
+    finish (hhhh, the Orisoft convention, on the first part of a split shift).
+    With fallback, a shift without a valid candidate then tries the hour code of the whole span of a split
+    shift and the hour code with the times rounded to the nearest hour, the codes translated by these
+    guesses are listed in fallbackCodes so their rows can be reported.
+    A shift without a valid candidate is translated to its first one and reported as invalid.
+    """
+    # format of the shiftMap keys
+    mapKey = re.compile(r'^\d{4}-\d{4}(/\d{4}-\d{4})?$')
+
+    def __init__(self, shiftMap=None, fallback=False):
+        self.shiftMap = shiftMap or {}          # shift times -> schedule type
+        self.fallback = fallback                # try the guessed hour codes of fallbacks
+        self.invalidMappings = []               # shiftMap entries whose schedule type is not valid
+        self.fallbackCodes = set()              # codes translated by a fallback
+
+    def candidates(self, shift):
+        """
+        Returns the schedule types a shift can translate to, the most specific first
+        """
+        (start, finish, split, start2, finish2, hours) = shift
+        if start is None or finish is None:
+            return ['']
+
+        times = '%s-%s' % (hhmm(start), hhmm(finish))
+        if self.isSplit(shift):
+            # the exact times of both parts, then the whole span
+            candidates = [self.shiftMap.get('%s/%s-%s' % (times, hhmm(start2), hhmm(finish2))),
+                          self.shiftMap.get('%s-%s' % (hhmm(start), hhmm(finish2)))]
+        else:
+            candidates = [self.shiftMap.get(times)]
+
+        # hour code of the start and finish, of the first part of a split shift
+        candidates.append('%02d%02d' % (start.hour, finish.hour))
+        return self.unique(candidates)
+
+    def fallbacks(self, shift):
+        """
+        Returns the guessed schedule types of a shift without valid candidate, tried with fallback
+        """
+        (start, finish, split, start2, finish2, hours) = shift
+        if start is None or finish is None:
+            return []
+
+        # hour codes of the whole span of a split shift, and rounded to the nearest hour
+        end = finish
+        if self.isSplit(shift):
+            end = finish2
+        return self.unique(['%02d%02d' % (start.hour, end.hour),
+                            '%02d%02d' % ((start.hour + (start.minute >= 30)) % 24, (end.hour + (end.minute >= 30)) % 24)])
+
+    def isSplit(self, shift):
+        (start, finish, split, start2, finish2, hours) = shift
+        return bool(split) and start2 is not None and finish2 is not None
+
+    def unique(self, candidates):
+        result = []
+        for schedType in candidates:
+            if schedType and schedType not in result:
+                result.append(schedType)
+        return result
+
+    def translate(self, codes, validSchedType):
+        """
+        Returns the schedule type and the validity of every code of a ScheduleMatrix
+        """
+        self.invalidMappings = sorted(key for (key, schedType) in self.shiftMap.items() if schedType not in validSchedType)
+        self.fallbackCodes = set()
+
+        schedTypes = [None]
+        validFlags = [False]
+        for (code, shift) in enumerate(codes[1:], 1):
+            if isinstance(shift, basestring):
+                # rest day schedule type
+                candidates = [shift]
+            else:
+                candidates = self.candidates(shift)
+
+            valid = [schedType for schedType in candidates if schedType in validSchedType]
+            if not valid and self.fallback and not isinstance(shift, basestring):
+                valid = [schedType for schedType in self.fallbacks(shift) if schedType in validSchedType]
+                if valid:
+                    self.fallbackCodes.add(code)
+            schedTypes.append((valid or candidates)[0])
+            validFlags.append(bool(valid))
+
+        return (schedTypes, validFlags)
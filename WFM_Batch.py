@@ -0,0 +1,146 @@
+#***********************************
+# Program Name : WFM_Batch.py
+# Description  : command line version of WFM_Interface for scheduled runs, does not need PySide or a display.
+#                The result is printed on stdout as one JSON line and returned as the exit code.
+#************************************
+
+import sys
+import json
+import argparse
+import multiprocessing
+from datetime import *
+from WFMEngine import *
+from WFMExport import exportReport, iterExceptionTable
+
+# exit codes
+EXIT_OK = 0
+EXIT_USAGE = 2                          # bad command line arguments, returned by argparse
+EXIT_CONFIG = 3                         # configuration file missing or invalid
+EXIT_CONNECT = 4                        # cannot connect to Orisoft TMS or WFM
+EXIT_PROCESS = 5                        # a process stage failed, nothing was saved (sharded or chunked runs keep what was committed)
+EXIT_EXPORT = 6                         # the exception report file cannot be written
+
+
+def parseDate(text):
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date '%s', the format is yyyy-mm-dd" % text)
+
+
+def printStatus(text):
+    sys.stderr.write(text + '\n')
+
+
+def report(exitCode, message, engine=None):
+    """
+    Prints the result of the run as one JSON line and returns exitCode
+    """
+    result = {'exitcode': exitCode, 'message': message}
+    if engine is not None:
+        result['timings'] = [{'stage': name, 'seconds': round(seconds, 3)} for (name, seconds) in engine.timings]
+        result['stages'] = [stage.record() for stage in engine.metrics] + engine.shardMetrics
+        # the counts, and the payrolls and badges to fix in WFM or Orisoft
+        result['unmatched'] = {'wfmpayrolls': len(engine.unmatchedPayrolls), 'orisoftbadges': len(engine.unmatchedBadges),
+                               'payrolls': engine.unmatchedPayrolls, 'badges': engine.unmatchedBadges}
+
+    print json.dumps(result)
+    return exitCode
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Interface the employees schedules in WFM into Orisoft.')
+    parser.add_argument('--from', dest='dateFrom', type=parseDate,
+        help='first date to process (yyyy-mm-dd), default is the day after the last process')
+    parser.add_argument('--to', dest='dateTo', type=parseDate,
+        help='last date to process (yyyy-mm-dd), default is the --from date')
+    parser.add_argument('--config', default='WFM_Interface.ini',
+        help='configuration file, default is WFM_Interface.ini')
+    parser.add_argument('--no-overwrite', dest='overWrite', action='store_false',
+        help='keep the schedules that are already in Orisoft')
+    parser.add_argument('--report', metavar='FILE',
+        help='write the exception report to FILE, .csv or .txt (fixed width), add .gz to compress it')
+    parser.add_argument('--report-only', dest='reportOnly', action='store_true',
+        help='do not process, only export the exceptions of the last run from user_wfm_exception to the --report FILE')
+    parser.add_argument('--commit-every', dest='commitEvery', type=int, metavar='N',
+        help='commit every N employees and record a checkpoint, default is [Options] commitevery')
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+        help='start over instead of resuming after the checkpoint of a failed run of the same dates')
+    parser.add_argument('--shards', type=int,
+        help='split the employees into SHARDS worker processes, default is [Options] shards of the configuration file')
+    parser.add_argument('--shard-by', dest='shardBy', choices=['workgroup', 'payroll'],
+        help='split the employees by work_group_code or by payroll range, default is [Options] shardby')
+    parser.add_argument('--quiet', action='store_true',
+        help='do not print the progress on stderr')
+    args = parser.parse_args(argv)
+
+    if args.reportOnly and not args.report:
+        parser.error('--report-only needs the --report FILE')
+
+    engine = WFMEngine(args.config)
+    if not args.quiet:
+        engine.status = printStatus
+
+    try:
+        engine.readIni()
+    except ConfigError, e:
+        return report(EXIT_CONFIG, str(e))
+
+    if args.commitEvery is not None:
+        if args.commitEvery < 0:
+            parser.error('--commit-every cannot be negative')
+        engine.commitEvery = args.commitEvery
+    engine.resume = args.resume
+
+    if args.shards is not None:
+        if args.shards < 1:
+            parser.error('--shards must be at least 1')
+        engine.shards = args.shards
+    if args.shardBy is not None:
+        engine.shardBy = args.shardBy
+
+    # default is the day after the to-date of the last process, same as the window
+    dateFrom = args.dateFrom
+    if dateFrom is None:
+        dateFrom = datetime.strptime(engine.dateToPrev, '%Y-%m-%d').date() + timedelta(1)
+    dateTo = args.dateTo or dateFrom
+    if dateTo < dateFrom:
+        parser.error('--to date is earlier than the --from date')
+
+    try:
+        engine.connect()
+    except ConnectError, e:
+        return report(EXIT_CONNECT, str(e))
+
+    if args.reportOnly:
+        # the table is streamed to the file, the report is never held in memory
+        try:
+            count = exportReport(iterExceptionTable(engine.connOriTMS, engine.batchSize), args.report)
+        except IOError, e:
+            return report(EXIT_EXPORT, str(e))
+        finally:
+            engine.close()
+        return report(EXIT_OK, '%d exception records exported to %s.' % (count, args.report))
+
+    try:
+        engine.process(dateFrom, dateTo, args.overWrite)
+        engine.saveIni()
+    except Exception, e:
+        return report(EXIT_PROCESS, str(e), engine)
+    finally:
+        engine.close()
+
+    message = 'Process finished! ' + engine.saveRate
+    if args.report:
+        try:
+            count = exportReport(engine.getExceptionReport(), args.report)
+        except IOError, e:
+            return report(EXIT_EXPORT, str(e), engine)
+        message += ' %d exception records exported to %s.' % (count, args.report)
+
+    return report(EXIT_OK, message, engine)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
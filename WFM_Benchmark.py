@@ -0,0 +1,389 @@
+#***********************************
+# Program Name : WFM_Benchmark.py
+# Description  : offline benchmark of the WFM interface on a SQLite stand-in of the Orisoft TMS and WFM databases.
+#                The roster.sql, roster_staff.sql and personnel.sql dumps are the templates of synthetic rosters
+#                scaled up to the requested number of employees and days, every pipeline stage is timed.
+#************************************
+
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, date, timedelta
+import time
+from WFMEngine import WFMEngine
+from WFMExport import exportReport
+
+# first day of every benchmark date range
+benchmarkStart = date(2013, 9, 1)
+
+# T-SQL statements of WFMEngine and their SQLite equivalents
+dialect = [
+    (re.compile(r"If object_id\('tempdb\.\.#(\w+)'\) is not null drop table #\w+", re.I), r'Drop table if exists \1'),
+    (re.compile(r'Create table #', re.I), 'Create temp table '),
+    (re.compile(r' collate database_default', re.I), ''),
+    (re.compile(r'Truncate table dbo\.', re.I), 'Delete from '),
+    # SQLite has no DELETE with a join, the joined rows are deleted by rowid so the join can still use the indexes
+    (re.compile(r'Delete (\w+) from (\w+) \1 (join .*)', re.I), r'Delete from \2 where rowid in (Select \1.rowid from \2 \1 \3)'),
+    (re.compile(r'#(\w+)'), r'\1'),
+    (re.compile(r'Select top 0 (.*)', re.I), r'Select \1 limit 0'),
+    (re.compile(r'SAVE TRANSACTION (\w+)', re.I), r'Savepoint \1'),
+    (re.compile(r'ROLLBACK TRANSACTION (\w+)', re.I), r'Rollback to \1'),
+]
+
+
+def translate(query):
+    """
+    Returns the SQLite version of a WFMEngine query
+    """
+    for (pattern, replacement) in dialect:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def parseDatetime(text):
+    # SQL Server datetime literals of the dumps, with or without the time and milliseconds
+    if len(text) == 10:
+        return datetime.strptime(text, '%Y-%m-%d')
+    if '.' in text:
+        return datetime.strptime(text, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+
+sqlite3.register_converter('datetime', parseDatetime)
+
+
+class SqliteCursor(object):
+    """
+    pyodbc-like cursor over a sqlite3 cursor that translates the T-SQL statements
+    """
+    def __init__(self, cursor, owner):
+        self.cursor = cursor
+        self.owner = owner
+
+    def execute(self, query, params=()):
+        query = translate(query)
+        if not query.lower().startswith('select'):
+            self.owner.begin()
+        self.cursor.execute(query, params)
+        return self
+
+    def executemany(self, query, params):
+        self.owner.begin()
+        self.cursor.executemany(translate(query), params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class SqliteConnection(object):
+    """
+    pyodbc-like connection, the first write opens a transaction that lasts until commit or rollback
+    like the implicit transactions of the driver. The transactions are opened here rather than by
+    sqlite3, which would commit before the savepoints of insertSchedules.
+    """
+    def __init__(self, database):
+        self.conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                                    isolation_level=None)
+        # varchar columns come back as str like pyodbc
+        self.conn.text_factory = str
+        self.inTransaction = False
+
+    def begin(self):
+        if not self.inTransaction:
+            self.conn.execute('Begin')
+            self.inTransaction = True
+
+    def commit(self):
+        if self.inTransaction:
+            self.conn.execute('Commit')
+            self.inTransaction = False
+
+    def rollback(self):
+        if self.inTransaction:
+            self.conn.execute('Rollback')
+            self.inTransaction = False
+
+    def cursor(self):
+        return SqliteCursor(self.conn.cursor(), self)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class BenchEngine(WFMEngine):
+    """
+    WFMEngine on the SQLite stand-in, with the options of the benchmark instead of a configuration file
+    """
+    def __init__(self, database, options):
+        super(BenchEngine, self).__init__(os.devnull)
+        self.database = database
+        self.batchSize = options.batchSize
+        self.writeMode = options.writeMode
+        self.incremental = False
+        self.parallelExtract = options.parallelExtract
+        self.semiJoin = options.semiJoin
+        self.commitEvery = options.commitEvery
+        self.shards = 1
+        self.resume = False
+        self.lastModify = None
+        self.loadSeconds = 0.0
+        self.loadDepth = 0
+
+    def openConnection(self, database, autocommit=False):
+        # both databases are the same SQLite file
+        return SqliteConnection(self.database)
+
+    def reserveIds(self, count):
+        # SQLite has no OUTPUT clause and allows one writer, the counter is advanced on the main connection
+        cur = self.connOriTMS.cursor()
+        cur.execute("Select ctrlctr from ofcctrlid where ctrlcol = 'employee_schedule'")
+        firstID = int(cur.fetchone()[0])
+        cur.execute("Update ofcctrlid set ctrlctr = ? where ctrlcol = 'employee_schedule'", (str(firstID + count),))
+        return firstID
+
+    def releaseIds(self, endID, firstUnused):
+        cur = self.connOriTMS.cursor()
+        cur.execute("Update ofcctrlid set ctrlctr = ? where ctrlcol = 'employee_schedule' and ctrlctr = ?",
+            (str(firstUnused), str(endID)))
+
+    def integrityError(self):
+        return sqlite3.IntegrityError
+
+    def saveCheckpoint(self, payroll):
+        # a benchmark run is never resumed
+        pass
+
+    def clearCheckpoint(self):
+        pass
+
+    def timed(self, method, *args):
+        # the database writes of saveSchedules are the load stage, the rest of it is the transform stage,
+        # a write called by another one (insertSchedules by syncSchedules) is only counted once
+        timeStart = time.time()
+        self.loadDepth += 1
+        try:
+            return method(*args)
+        finally:
+            self.loadDepth -= 1
+            if not self.loadDepth:
+                self.loadSeconds += time.time() - timeStart
+
+    def insertSchedules(self, cur, batch):
+        return self.timed(super(BenchEngine, self).insertSchedules, cur, batch)
+
+    def stageSchedules(self, cur, batch):
+        return self.timed(super(BenchEngine, self).stageSchedules, cur, batch)
+
+    def mergeSchedules(self, cur):
+        return self.timed(super(BenchEngine, self).mergeSchedules, cur)
+
+    def syncSchedules(self, cur, schedules, payrolls=None):
+        return self.timed(super(BenchEngine, self).syncSchedules, cur, schedules, payrolls)
+
+    def saveExceptions(self, cur, start=0):
+        return self.timed(super(BenchEngine, self).saveExceptions, cur, start)
+
+
+def readTemplates(folder):
+    """
+    Loads the dumps into an in-memory database and returns the shift templates (start, finish, hours)
+    and the (surname, firstname) of the personnel
+    """
+    conn = sqlite3.connect(':memory:')
+    for name in ('roster.sql', 'roster_staff.sql', 'personnel.sql'):
+        conn.executescript(open(os.path.join(folder, name)).read())
+
+    shifts = conn.execute("Select distinct start, finish, hours from roster_staff where hours > 0 order by start").fetchall()
+    names = conn.execute("Select surname, firstname from personnel order by payroll").fetchall()
+    conn.close()
+    return ([tuple(str(value) for value in shift[:2]) + (shift[2],) for shift in shifts],
+        [(str(surname), str(firstname)) for (surname, firstname) in names])
+
+
+def createDatabase(database, templates, employeeCount, dayCount):
+    """
+    Creates the stand-in tables with employeeCount employees rostered for dayCount days from benchmarkStart.
+    About 2% of the WFM payrolls have no badge, 2% of the badges have no roster, 1% of the employees
+    have no workgroup schedule and one shift has no schedule type, so every exception is exercised.
+    """
+    (shifts, names) = templates
+    if os.path.exists(database):
+        os.remove(database)
+
+    conn = sqlite3.connect(database)
+    conn.text_factory = str
+    conn.execute('pragma journal_mode = wal')
+    conn.executescript("""
+        Create table roster ([key] int primary key, start datetime, shift varchar(20));
+        Create table roster_staff (roster_key int, payroll varchar(10), start datetime, finish datetime, split bit,
+            start2 datetime, finish2 datetime, hours float, current_userdate datetime, lastModify datetime, rdate datetime);
+        Create table employee_badge (employee_no varchar(20) primary key, employee_name varchar(60),
+            work_group_code varchar(10), employee_status varchar(1));
+        Create table schedule_type (schedule_type_code varchar(20) primary key);
+        Create table group_schedule_hd (id int primary key, work_group varchar(10), work_period_id varchar(10));
+        Create index group_schedule_hd_period on group_schedule_hd (work_period_id);
+        Create table ofcctrlid (ctrlcol varchar(30) primary key, ctrlctr varchar(20));
+        Create table employee_schedule (ID int primary key, REFER_ID varchar(30), BADGE_NO varchar(20),
+            EMPLOYEE_NO varchar(20), SCHEDULE_DATE datetime, SEQ_NO int, SCHEDULE_TYPE varchar(20),
+            CREATED_BY varchar(20), CREATED_DATE datetime);
+        Create unique index employee_schedule_badge on employee_schedule (BADGE_NO, SCHEDULE_DATE, SEQ_NO);
+        Create table user_wfm_exception (EMPLOYEE_NO varchar(20), EMPLOYEE_NAME varchar(60), SCHEDULE_DATE varchar(10),
+            SCHEDULE_TYPE varchar(20), WORK_GROUP varchar(10), REMARKS varchar(60), CREATED_BY varchar(20), CREATED_DATE datetime);
+    """)
+
+    days = [benchmarkStart + timedelta(offset) for offset in range(dayCount)]
+    workgroups = ['WG%02d' % index for index in range(20)]
+
+    # one roster per shift and day
+    rosterKeys = {}
+    rosters = []
+    for (dayIndex, day) in enumerate(days):
+        for (shiftIndex, shift) in enumerate(shifts):
+            key = dayIndex * len(shifts) + shiftIndex + 1
+            rosterKeys[(dayIndex, shiftIndex)] = key
+            rosters.append((key, day.isoformat(), '%s - %s' % (shift[0][11:16], shift[1][11:16])))
+    conn.executemany("Insert into roster ([key], start, shift) values (?, ?, ?)", rosters)
+
+    # start2 and finish2 of the shifts that are not split, as in the dumps
+    noTime = '1899-12-30 00:00:00.000'
+    badges = []
+    staff = []
+    for index in range(employeeCount):
+        payroll = '%06d' % (index + 1)
+        (surname, firstname) = names[index % len(names)]
+        if index % 50 != 1:
+            # WFM payroll without an Orisoft badge
+            workgroup = 'WGXX' if index % 100 == 7 else workgroups[index % len(workgroups)]
+            badges.append((payroll, '%s,%s' % (surname, firstname), workgroup, 'A'))
+        if index % 50 == 2:
+            # Orisoft badge without a WFM roster
+            continue
+
+        for (dayIndex, day) in enumerate(days):
+            # two rest days a week are missing from the roster and filled by the interface
+            if (index + dayIndex) % 7 in (5, 6):
+                continue
+            shiftIndex = (index + dayIndex // 7) % len(shifts)
+            (start, finish, hours) = shifts[shiftIndex]
+            rdate = day.isoformat() + ' 00:00:00.000'
+            staff.append((rosterKeys[(dayIndex, shiftIndex)], payroll, start, finish, 0, noTime, noTime, hours, None, None, rdate))
+
+        if len(staff) >= 100000:
+            conn.executemany("Insert into roster_staff values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", staff)
+            staff = []
+    conn.executemany("Insert into roster_staff values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", staff)
+    conn.executemany("Insert into employee_badge values (?, ?, ?, ?)", badges)
+    conn.execute("Create index roster_staff_key on roster_staff (roster_key)")
+    conn.execute("Create index roster_start on roster (start)")
+
+    # every shift code except the last one is a valid schedule type
+    codes = sorted(set(start[11:13] + finish[11:13] for (start, finish, hours) in shifts))
+    conn.executemany("Insert into schedule_type values (?)", [(code,) for code in codes[:-1] + ['RD08', 'RD11', 'REST']])
+
+    periods = sorted(set((day.year, day.month) for day in days))
+    groups = [(index + 1, workgroup, '%02d/01/%d' % (month, year))
+        for (index, (workgroup, (year, month))) in enumerate([(workgroup, period) for workgroup in workgroups for period in periods])]
+    conn.executemany("Insert into group_schedule_hd values (?, ?, ?)", groups)
+    conn.execute("Insert into ofcctrlid values ('employee_schedule', '1')")
+
+    conn.commit()
+    conn.close()
+    return len(badges)
+
+
+def runScenario(database, options, employeeCount, dayCount, reportFile):
+    """
+    Runs the interface on the stand-in and returns the seconds of every stage
+    """
+    engine = BenchEngine(database, options)
+    engine.connect()
+    try:
+        timeStart = time.time()
+        engine.run(benchmarkStart, benchmarkStart + timedelta(dayCount - 1), overWrite=True)
+        timings = dict(engine.timings)
+        total = time.time() - timeStart
+
+        timeStart = time.time()
+        exportReport(engine.getExceptionReport(), reportFile)
+        report = time.time() - timeStart
+    finally:
+        engine.close()
+
+    return {'employees': employeeCount,
+            'days': dayCount,
+            'rows': engine.savedCount,
+            'exceptions': len(engine.exceptions),
+            'extract': timings['getDaysRange'] + timings['extract'],
+            'transform': timings['saveSchedules'] - engine.loadSeconds,
+            'load': engine.loadSeconds,
+            'report': report,
+            'total': total + report}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the WFM interface on a SQLite stand-in with synthetic rosters.')
+    parser.add_argument('--employees', default='1000,10000,50000',
+        help='comma separated numbers of employees, default is 1000,10000,50000')
+    parser.add_argument('--days', default='1,31,92',
+        help='comma separated numbers of days, default is 1,31,92')
+    parser.add_argument('--writemode', dest='writeMode', choices=['insert', 'upsert', 'diff'], default='insert',
+        help='write mode of the interface, default is insert')
+    parser.add_argument('--batchsize', dest='batchSize', type=int, default=1000,
+        help='schedule rows per batch, default is 1000')
+    parser.add_argument('--commit-every', dest='commitEvery', type=int, default=0, metavar='N',
+        help='commit every N employees, default is one transaction')
+    parser.add_argument('--serial-extract', dest='parallelExtract', action='store_false',
+        help='run the extraction queries one after the other')
+    parser.add_argument('--no-semijoin', dest='semiJoin', action='store_false',
+        help='load all the active employees instead of the ones with a WFM roster')
+    parser.add_argument('--templates', default=os.path.dirname(os.path.abspath(__file__)),
+        help='folder of roster.sql, roster_staff.sql and personnel.sql, default is the program folder')
+    parser.add_argument('--keep', metavar='FOLDER',
+        help='keep the databases and exception reports in FOLDER')
+    args = parser.parse_args(argv)
+
+    try:
+        employeeCounts = [int(count) for count in args.employees.split(',')]
+        dayCounts = [int(count) for count in args.days.split(',')]
+    except ValueError:
+        parser.error('--employees and --days are comma separated numbers')
+
+    templates = readTemplates(args.templates)
+    folder = args.keep or tempfile.mkdtemp(prefix='wfm_benchmark')
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    # the first pass loads an empty employee_schedule, the second one runs again over the schedules it saved,
+    # as a scheduled run does when WFM has not changed
+    columns = ('employees', 'days', 'pass', 'rows', 'exceptions', 'extract', 'transform', 'load', 'report', 'total')
+    print '%9s %5s %4s %9s %10s %9s %9s %9s %9s %9s %10s' % (columns + ('rows/sec',))
+    try:
+        for employeeCount in employeeCounts:
+            for dayCount in dayCounts:
+                name = 'wfm_%d_%d' % (employeeCount, dayCount)
+                database = os.path.join(folder, name + '.db')
+                createDatabase(database, templates, employeeCount, dayCount)
+                for runPass in (1, 2):
+                    result = runScenario(database, args, employeeCount, dayCount,
+                                         os.path.join(folder, '%s_%d.csv' % (name, runPass)))
+                    result['pass'] = runPass
+
+                    rate = result['total'] and result['rows'] / result['total'] or 0.0
+                    print '%9d %5d %4d %9d %10d %9.2f %9.2f %9.2f %9.2f %9.2f %10.0f' % \
+                        (tuple(result[column] for column in columns) + (rate,))
+                    sys.stdout.flush()
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
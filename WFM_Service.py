@@ -0,0 +1,175 @@
+#***********************************
+# Program Name : WFM_Service.py
+# Description  : long-running version of WFM_Batch. Polls WFM for changed roster_staff rows and pushes them to
+#                Orisoft in small committed batches, the connections are kept open in pools between the polls.
+#                Prints one JSON line per sync on stdout and runs until stopped with Ctrl+C or SIGTERM.
+#************************************
+
+import sys
+import json
+import signal
+import argparse
+import ConfigParser
+from datetime import datetime, date, timedelta
+import time
+from WFMEngine import *
+from WFM_Batch import printStatus, EXIT_OK, EXIT_CONFIG
+
+
+class SyncService(object):
+    """
+    Every interval seconds, runs the process on the rolling window of daysBack days before today
+    to daysAhead days after it if WFM has roster rows in the window that are not synced yet.
+    The days already synced only load their changed rows, the days new to the window are loaded in full.
+    Every fullRefresh seconds, and on the first poll, the whole window is synced whatever the changes, it picks
+    up the rows WFM saved without modification time. The high-water mark is only saved after a successful
+    sync, a failed one is retried by the next poll.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.interval = 60                      # seconds between two polls
+        self.daysBack = 0
+        self.daysAhead = 31
+        self.poolSize = 4                       # idle connections kept per database
+        self.commitEvery = 100                  # employees per committed batch
+        self.fullRefresh = 86400                # seconds between two syncs of the whole window
+        self.lastFullRefresh = None             # time of the last successful full sync
+        self.stopped = False
+        self.failures = 0                       # polls failed in a row
+
+    def readIni(self):
+        """
+        Reads the [Service] section of the configuration file of the engine
+        """
+        try:
+            config = ConfigParser.ConfigParser()
+            config.read(self.engine.iniFile)
+            if config.has_section('Service'):
+                for (name, attribute) in (('interval', 'interval'), ('daysback', 'daysBack'), ('daysahead', 'daysAhead'),
+                                          ('poolsize', 'poolSize'), ('commitevery', 'commitEvery'),
+                                          ('fullrefresh', 'fullRefresh')):
+                    if config.has_option('Service', name):
+                        setattr(self, attribute, config.getint('Service', name))
+        except (ConfigParser.Error, ValueError), e:
+            raise ConfigError(str(e))
+
+        if self.interval < 1 or self.poolSize < 1 or self.fullRefresh < 1:
+            raise ConfigError('[Service] interval, poolsize and fullrefresh must be at least 1')
+
+    def stop(self, *args):
+        # the running sync is finished, the service stops before the next poll
+        self.stopped = True
+
+    def run(self, once=False):
+        engine = self.engine
+        engine.usePools(self.poolSize)
+        engine.commitEvery = self.commitEvery
+        # the changed rows replace the schedules of their days, insert and upsert would leave the old
+        # schedules of a shift moved to another day
+        engine.writeMode = 'diff'
+        # the pools belong to this process, the shard workers would open their own connections
+        engine.shards = 1
+        # see WFMEngine.changeFilter, without a high-water mark the whole window is loaded
+        engine.incremental = True
+
+        try:
+            while not self.stopped:
+                self.poll()
+                if once:
+                    break
+                # a failing database is polled less and less often, up to 10 intervals apart
+                self.sleep(self.interval * min(2 ** self.failures, 10))
+        finally:
+            engine.closePools()
+
+    def sleep(self, seconds):
+        timeEnd = time.time() + seconds
+        while not self.stopped and time.time() < timeEnd:
+            time.sleep(min(1, timeEnd - time.time()))
+
+    def poll(self):
+        """
+        Syncs the changes of the window if there are any and prints the result
+        """
+        engine = self.engine
+        today = date.today()
+        dateFrom = today - timedelta(self.daysBack)
+        dateTo = today + timedelta(self.daysAhead)
+        timeStart = time.time()
+        full = self.lastFullRefresh is None or timeStart - self.lastFullRefresh >= self.fullRefresh
+        result = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'datefrom': dateFrom.isoformat(),
+                  'dateto': dateTo.isoformat(), 'changes': 0}
+
+        try:
+            engine.connect()
+            changes = engine.countChanges(dateFrom, dateTo)
+            result['changes'] = changes
+            if changes or full:
+                # the exception table holds the exceptions of the last sync with changes.
+                # process only moves the high-water mark once the sync is committed
+                engine.incremental = not full
+                try:
+                    engine.process(dateFrom, dateTo, True)
+                finally:
+                    engine.incremental = True
+                engine.saveIni(history=False)
+                if full:
+                    self.lastFullRefresh = timeStart
+                    result['full'] = True
+                result['rows'] = engine.savedCount
+                result['exceptions'] = len(engine.exceptions)
+                result['message'] = engine.saveRate
+            engine.close()
+            self.failures = 0
+        except Exception, e:
+            # the connections may be dead, they are not given back to the pools
+            engine.close(broken=True)
+            self.failures += 1
+            result['error'] = str(e)
+
+        result['seconds'] = round(time.time() - timeStart, 3)
+        result['connections'] = sum(pool.opened for pool in engine.pools.values())
+        if result['changes'] or 'full' in result or 'error' in result:
+            print json.dumps(result)
+            sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sync the WFM roster changes into Orisoft until stopped.')
+    parser.add_argument('--config', default='WFM_Interface.ini',
+        help='configuration file, default is WFM_Interface.ini')
+    parser.add_argument('--interval', type=int,
+        help='seconds between two polls, default is [Service] interval of the configuration file or 60')
+    parser.add_argument('--once', action='store_true',
+        help='poll and sync once, then exit')
+    parser.add_argument('--quiet', action='store_true',
+        help='do not print the progress on stderr')
+    args = parser.parse_args(argv)
+
+    engine = WFMEngine(args.config)
+    if not args.quiet:
+        engine.status = printStatus
+
+    service = SyncService(engine)
+    try:
+        engine.readIni()
+        service.readIni()
+    except ConfigError, e:
+        print json.dumps({'exitcode': EXIT_CONFIG, 'message': str(e)})
+        return EXIT_CONFIG
+
+    if args.interval is not None:
+        if args.interval < 1:
+            parser.error('--interval must be at least 1')
+        service.interval = args.interval
+
+    signal.signal(signal.SIGINT, service.stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, service.stop)
+
+    service.run(args.once)
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
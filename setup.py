@@ -1,5 +1,30 @@
+import os
+import sys
+import time
+import subprocess
 from distutils.core import setup
 import py2exe
 
+
+def timeToWindow(exe, runs=3):
+	"""
+	Starts exe with --startup-time, which exits once its window is shown, and returns the best of runs seconds
+	"""
+	best = None
+	for i in range(runs):
+		timeStart = time.time()
+		# run from this folder so WFM_Interface.ini is found
+		subprocess.call([exe, '--startup-time'], cwd=os.path.dirname(os.path.abspath(__file__)))
+		seconds = time.time() - timeStart
+		if best is None or seconds < best:
+			best = seconds
+	return best
+
+
 setup(windows=['WFM_Interface.py'],
+		console=['WFM_Batch.py', 'WFM_Service.py'],
 		options = {"py2exe": {'includes':'decimal'}})
+
+exe = os.path.join('dist', 'WFM_Interface.exe')
+if 'py2exe' in sys.argv and os.path.exists(exe):
+	print 'WFM_Interface.exe time to window: %.2f seconds' % timeToWindow(os.path.abspath(exe))